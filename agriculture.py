@@ -19,9 +19,9 @@ groups = {
 }
 
 base = 0
+original = kgm.snapshot()
 for key, val in groups.items():
     kgm.clear_all_flows()
-    boni = []
     area = 0
     for district in val:
         # record additional offsets that are difficult to re-compute
@@ -30,7 +30,6 @@ for key, val in groups.items():
         # re-compute this district's water demand with the coefficient
         district.compute_demand(a=0.776)
         district.demand += bonus
-        boni += [bonus]
         area += district.area
     kgm.get_flow(kr.OUT)
     if key == 'base':
@@ -40,7 +39,5 @@ for key, val in groups.items():
     print('%s: %s, %f' % (key, kr.OUT.flow, delta / area))
 
     # restore the original for the next analysis group
-    for bonus, district in zip(boni, val):
-        district.compute_demand()
-        district.demand += bonus
+    kgm.restore(original)
 
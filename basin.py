@@ -0,0 +1,222 @@
+# loading river basins from declarative JSON data files
+# see ganges.json for the format; it describes the same network as model.py
+#
+#   nodes: list of {name, crop, area, population}; all but name optional
+#   reaches: list of {name, source, destination, pollution, weight}
+#     weight is the routing weight, and optional
+#   seasons: {season: {rainfall, crops: {node: crop}, flows: {reach: flow}}}
+#     reaches given a flow by the season are its root reaches
+#   outlet: name of the reach out of the basin; optional, defaults to OUT
+#   offsets: list of demand offsets, applied in order, each one of
+#     {type: 'constant', offset, distributed}   (e.g. an aquifer)
+#     {type: 'rainfall'}                        (the season's rainfall)
+#     {type: 'population', population}          (spread over irrigated area)
+#
+# loaded basins are cached keyed by a hash of the file, so reloading an
+# unchanged basin skips parsing, linking and validation
+# the cache holds the flat arrays of the basin's CompiledGraph, not pickled
+#   objects: load_plan reads them straight back, and load_basin only
+#   rebuilds the Node and Edge objects from them
+
+import hashlib
+import json
+import os
+import struct
+from array import array
+
+from compiled import CompiledGraph
+from network import Node, Edge, Graph
+
+# bumped whenever the cached form of a basin changes, so stale caches
+# are not loaded
+CACHE_VERSION = b'4'
+
+# build a Graph for one season from parsed basin data
+def build_basin(data, season):
+    if season not in data['seasons']:
+        raise Exception('Unknown season [%s]' % season)
+    params = data['seasons'][season]
+    crops = params.get('crops', {})
+    flows = params.get('flows', {})
+
+    graph = Graph()
+    for spec in data['nodes']:
+        graph.add_node(Node(spec['name'],
+                            crops.get(spec['name'], spec.get('crop', 'none')),
+                            spec.get('area', 0),
+                            spec.get('population', 0)))
+
+    for spec in data['reaches']:
+        src = graph.get_node(spec['source'])
+        dst = graph.get_node(spec['destination'])
+        if src is None or dst is None:
+            raise Exception('Reach [%s] joins unknown nodes [%s => %s]'
+                            % (spec['name'], spec['source'],
+                               spec['destination']))
+        graph.add_edge(Edge(spec['name'], flows.get(spec['name'], -1),
+                            spec['pollution'], spec.get('weight', 1)),
+                       src, dst)
+
+    unknown = set(flows) - set(graph.edge_ends)
+    if unknown:
+        raise Exception('Season [%s] gives flows for unknown reaches [%s]'
+                        % (season, ', '.join(sorted(unknown))))
+
+    for offset in data.get('offsets', []):
+        if offset['type'] == 'constant':
+            graph.apply_constant_offset(offset['offset'],
+                                        offset.get('distributed', False))
+        elif offset['type'] == 'rainfall':
+            graph.apply_area_offset(-params.get('rainfall', 0))
+        elif offset['type'] == 'population':
+            total_area = sum([node.area for node in graph.nodes])
+            pop_density = offset['population'] / total_area
+            graph.apply_area_offset(pop_density * Node.scarcity_threshold
+                                    / 1000000)
+        else:
+            raise Exception('Unknown offset type [%s]' % offset['type'])
+
+    graph.set_root()
+
+    # this raises a GraphError if the basin is miswired, and caches the
+    # order and the execution plan, whose arrays are what gets cached
+    graph.compile(data.get('outlet', 'OUT'))
+    return graph
+
+# the flat form of a built basin, as written to its cache file
+# returns (header, arrays by name): the header holds names, crops, areas,
+#   populations, the outlet and the season parameters, and lists the arrays
+#   of the basin's CompiledGraph, plus the Graph's own node order
+def flatten(graph, params):
+    plan = graph.plan
+    node_names, edge_names, arrays = plan.flat()
+    arrays = dict(arrays)
+    arrays['node_order'] = array('l', [plan.node_id[node.name]
+                                       for node in graph.nodes])
+    nodes = [graph.get_node(name) for name in node_names]
+    header = {
+        'nodes': node_names,
+        'edges': edge_names,
+        'crops': [node.crop for node in nodes],
+        'areas': [node.area for node in nodes],
+        'populations': [node.population for node in nodes],
+        'outlet': plan.outlet,
+        'params': params,
+        'arrays': [[name, a.typecode, len(a)]
+                   for name, a in sorted(arrays.items())]
+    }
+    return header, arrays
+
+# write a flattened basin to a cache file: a length-prefixed JSON header,
+# followed by the raw bytes of each array it lists
+def write_cache(path, header, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = json.dumps(header).encode()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(struct.pack('<Q', len(data)) + data)
+        for name, _, _ in header['arrays']:
+            arrays[name].tofile(f)
+    os.replace(path + '.tmp', path)
+
+# read a cache file back; returns (header, arrays by name)
+def read_cache(path):
+    with open(path, 'rb') as f:
+        size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(size))
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            arrays[name] = array(typecode)
+            arrays[name].fromfile(f, length)
+    return header, arrays
+
+# rebuild the CompiledGraph of a cache file, without any Node or Edge objects
+def rebuild_plan(header, arrays):
+    plan = CompiledGraph.from_flat(header['nodes'], header['edges'], arrays)
+    plan.outlet = header['outlet']
+    return plan
+
+# rebuild the Graph a cache file was written from, with its order and
+# execution plan already in place
+def rebuild_basin(header, arrays):
+    plan = rebuild_plan(header, arrays)
+    nodes = []
+    for i, name in enumerate(header['nodes']):
+        node = Node(name, header['crops'][i], header['areas'][i],
+                    header['populations'][i])
+        node.demand = plan.demand[i]    # offsets included
+        nodes += [node]
+
+    edges = [Edge(name, plan.flow[e], plan.pollution[e], plan.weight[e])
+             for e, name in enumerate(header['edges'])]
+    for e, edge in enumerate(edges):
+        edge.root = bool(plan.root[e])
+
+    # fill in the Graph's indexes straight from the compiled ones, rather
+    # than through add_edge; outflows and inflows keep their compiled order
+    graph = Graph()
+    names = header['nodes']
+    for i in arrays['node_order']:
+        graph.nodes += [nodes[i]]
+        graph.node_index[names[i]] = nodes[i]
+        graph.edges[names[i]] = [(edges[e], names[plan.edge_dst[e]]) for e
+                                 in plan.out_idx[plan.out_ptr[i]:
+                                                 plan.out_ptr[i + 1]]]
+        graph.inflows[names[i]] = [edges[e] for e
+                                   in plan.in_idx[plan.in_ptr[i]:
+                                                  plan.in_ptr[i + 1]]]
+    for e, edge in enumerate(edges):
+        graph.edge_ends[edge.name] = (names[plan.edge_src[e]],
+                                      names[plan.edge_dst[e]])
+    graph.order = nodes
+    graph.plan = plan
+    return graph
+
+# read a basin data file and find its cache file for a season
+# returns (raw file contents, cache file path or None if caching is off)
+def find_cache(path, season, cache_dir):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if cache_dir is None:
+        return raw, None
+    if cache_dir == '':
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                 '.basin_cache')
+    key = hashlib.sha256(raw + b'\0' + season.encode() + b'\0'
+                         + CACHE_VERSION).hexdigest()
+    return raw, os.path.join(cache_dir, key + '.basin')
+
+# build a season of a basin from its raw data, and cache it if asked to
+# returns (graph, season parameters)
+def build_cached(raw, season, cache):
+    data = json.loads(raw)
+    graph = build_basin(data, season)
+    params = data['seasons'][season]
+    if cache is not None:
+        write_cache(cache, *flatten(graph, params))
+    return graph, params
+
+# load a season of a basin data file as a Graph
+# takes:
+#   path of the JSON data file (string)
+#   season to build (string)
+#   cache_dir: where compiled basins are kept; defaults to a .basin_cache
+#     directory next to the data file; None disables caching
+# returns (graph, season parameters from the file)
+def load_basin(path, season, cache_dir=''):
+    raw, cache = find_cache(path, season, cache_dir)
+    if cache is not None and os.path.exists(cache):
+        header, arrays = read_cache(cache)
+        return rebuild_basin(header, arrays), header['params']
+    return build_cached(raw, season, cache)
+
+# load a season of a basin data file as just its CompiledGraph
+# takes the same arguments as load_basin; from the cache, this builds no
+#   Node or Edge objects at all
+# returns (compiled graph, season parameters from the file)
+def load_plan(path, season, cache_dir=''):
+    raw, cache = find_cache(path, season, cache_dir)
+    if cache is not None and os.path.exists(cache):
+        header, arrays = read_cache(cache)
+        return rebuild_plan(header, arrays), header['params']
+    graph, params = build_cached(raw, season, cache)
+    return graph.plan, params
@@ -0,0 +1,163 @@
+# timing benchmarks for the network model on synthetic river basins
+# run as a script; results are printed as JSON so runs can be compared
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from network import Node, IrrDistrict, UrbArea, Edge, Graph
+
+# range of the random pollution indices given to reaches
+POLLUTION = (0.4, 0.9)
+
+# generate a random river basin with the real Node/Edge/Graph classes
+# takes:
+#   nodes: number of demand nodes (int)
+#   branching: number of downstream reaches leaving each node (int)
+#   roots: number of extra root inflows, on top of one per headwater (int)
+#   seed: random seed, so that runs are repeatable
+# node 0 drains to the outlet; every other node drains to [branching]
+#   randomly chosen lower-numbered nodes, which keeps the graph acyclic
+# every root reach gets the same flow, sized to the basin so that no
+#   district ever runs dry, however the forks split the water; see
+#   root_flow
+# returns (graph, edge_list, outlet); the graph only holds the nodes, so
+#   that adding the edges can be timed separately
+def random_basin(nodes, branching=1, roots=0, seed=0):
+    rng = random.Random(seed)
+    crops = [c for c in Node.crop_needs if c != 'none']
+
+    districts = []
+    for i in range(nodes):
+        name = 'N-%d' % i
+        if rng.random() < 0.1:
+            districts += [UrbArea(name, rng.randint(10000, 1000000))]
+        else:
+            districts += [IrrDistrict(name, rng.choice(crops),
+                                      rng.uniform(1, 50))]
+    extern = Node('EXTERN', 'none', 0, 0)
+
+    graph = Graph()
+    graph.add_nodes_from_list(districts)
+    graph.add_node(extern)
+
+    edges = []
+    downstream = [[] for _ in range(nodes)]
+    has_upstream = [False] * nodes
+    for i in range(1, nodes):
+        for j in rng.sample(range(i), min(branching, i)):
+            edges += [(Edge('R-%d-%d' % (i, j), -1, rng.uniform(*POLLUTION)),
+                       districts[i], districts[j])]
+            downstream[i] += [j]
+            has_upstream[j] = True
+
+    # every headwater gets a root inflow, plus any extra ones asked for
+    fed = [i for i in range(nodes) if not has_upstream[i]]
+    fed += rng.sample(range(nodes), min(roots, nodes))
+    flow = root_flow(districts, downstream, fed)
+    for k, i in enumerate(fed):
+        edges += [(Edge('IN-%d' % k, flow, rng.uniform(*POLLUTION)),
+                   extern, districts[i])]
+
+    outlet = Edge('OUT', -1, 1)
+    edges += [(outlet, districts[0], extern)]
+    return graph, edges, outlet
+
+# a root flow large enough that no district of a random basin runs dry
+# takes the districts, the downstream district indices of each one, and
+#   the indices of the districts fed by a root reach
+# with no demands, a root flow of R brings R * share to a district, where
+#   share is its split-up portion of the root reaches above it; demands
+#   upstream take out at most sum(demand) / min pollution, and a district
+#   needs at most its demand / min pollution, so R = 2 * sum(demand) /
+#   (min pollution * min share) is always enough
+def root_flow(districts, downstream, fed):
+    share = [0.0] * len(districts)
+    for i in fed:
+        share[i] += 1
+    # reaches only run to lower-numbered districts
+    for i in reversed(range(len(districts))):
+        for j in downstream[i]:
+            share[j] += share[i] / len(downstream[i])
+    demand = sum(d.demand for d in districts)
+    return max(2 * demand / (POLLUTION[0] * min(share)), 1.0)
+
+# time a single call, in seconds
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    f(*args, **kwargs)
+    return time.perf_counter() - start
+
+# run every benchmark on one synthetic basin
+# returns a list of result records, one per timed operation
+def run(nodes, branching=1, roots=0, seed=0):
+    graph, edges, outlet = random_basin(nodes, branching, roots, seed)
+
+    times = {}
+    times['add_edges_from_list'] = timed(graph.add_edges_from_list, edges)
+    graph.set_root()
+    times['get_flow'] = timed(graph.get_flow, outlet)
+    times['clear_all_flows'] = timed(graph.clear_all_flows)
+    times['solve'] = timed(graph.solve)
+    times['report'] = timed(graph.report)
+    times['apply_constant_offset'] = timed(graph.apply_constant_offset,
+                                           -1.0, distributed=True)
+
+    return [{
+        'op': op,
+        'nodes': nodes,
+        'reaches': len(edges),
+        'branching': branching,
+        'roots': roots,
+        'seed': seed,
+        'seconds': seconds
+    } for op, seconds in times.items()]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the network model '
+                                     'on synthetic river basins.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000, 100000],
+                        help='basin sizes to run, in nodes')
+    parser.add_argument('--branching', type=int, default=1)
+    parser.add_argument('--roots', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON here, not to stdout')
+    parser.add_argument('--check', action='store_true',
+                        help='only check that every size solves with '
+                        'branching 1 to 4 and with and without extra roots')
+    args = parser.parse_args()
+
+    # get_flow recurses once per reach on the way to the outlet
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * max(args.sizes)))
+
+    if args.check:
+        failed = False
+        for size in args.sizes:
+            for branching in range(1, 5):
+                for roots in (0, size // 10):
+                    graph, edges, outlet = random_basin(size, branching,
+                                                        roots, args.seed)
+                    graph.add_edges_from_list(edges)
+                    graph.set_root()
+                    try:
+                        graph.solve()
+                        status = 'ok'
+                    except Exception as err:
+                        status = 'FAILED: %s' % str(err).splitlines()[0]
+                        failed = True
+                    print('nodes %d, branching %d, roots %d: %s'
+                          % (size, branching, roots, status))
+        sys.exit(1 if failed else 0)
+
+    results = []
+    for size in args.sizes:
+        results += run(size, args.branching, args.roots, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
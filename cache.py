@@ -0,0 +1,157 @@
+# persistent cache of solve results, keyed by a fingerprint of the graph
+# reruns of the same (or overlapping) analyses read their flows back from
+# disk instead of solving again
+
+import hashlib
+import json
+import sqlite3
+import struct
+from array import array
+
+# hash of everything a solve depends on: the topology, node demands and
+# edge pollution indices, routing weights, root flags and root flows
+# areas, populations and crops are included too, so graphs that only
+# agree by coincidence do not share results
+# flows of non-root reaches are outputs, and are left out, and so are the
+# mixed pollution indices of water-quality mode, whose inputs are hashed
+def fingerprint(graph, strict=True):
+    h = hashlib.sha256()
+    h.update(b'strict' if strict else b'tolerant')
+    h.update(b'mixing' if graph.mixing else b'fixed')
+    for node in graph.nodes:
+        h.update(node.name.encode() + b'\0' + node.crop.encode() + b'\0')
+        h.update(struct.pack('<ddd', node.demand, node.area, node.population))
+    for src, val in graph.edges.items():
+        for edge, dst in val:
+            h.update(('%s\0%s\0%s\0' % (edge.name, src, dst)).encode())
+            pollution = graph.base_pollution.get(edge.name, edge.pollution)
+            h.update(struct.pack('<dd?d', pollution, edge.weight,
+                                 edge.root, edge.flow if edge.root else 0))
+    return h.hexdigest()
+
+class ResultCache(object):
+    # a ResultCache is an SQLite table of solve results on local disk
+    # each entry holds the flows of every reach, in graph order, and the
+    # unmet demands of any nodes that ran dry; see solve for water-quality
+    # mode
+    # when the entries outgrow max_bytes, the least recently used go first
+
+    # constructor takes:
+    #   path of the database file (string), created if missing
+    #   max_bytes: size limit of the stored results (int)
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'key TEXT PRIMARY KEY, flows BLOB, deficits TEXT, '
+                        'size INTEGER, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used '
+                        'ON results (used)')
+
+        # running total of the entry sizes, kept by triggers so every
+        #   process sharing the file sees it, and puts need not sum the table
+        # REPLACE does not fire delete triggers, so put deletes first
+        self.db.execute('CREATE TABLE IF NOT EXISTS usage (total INTEGER)')
+        self.db.execute('INSERT INTO usage SELECT (SELECT COALESCE(SUM(size), '
+                        '0) FROM results) WHERE NOT EXISTS (SELECT 1 FROM '
+                        'usage)')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS results_insert '
+                        'AFTER INSERT ON results BEGIN UPDATE usage '
+                        'SET total = total + NEW.size; END')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS results_delete '
+                        'AFTER DELETE ON results BEGIN UPDATE usage '
+                        'SET total = total - OLD.size; END')
+        self.db.commit()
+
+    # look up an entry; returns (flows, deficits) or None
+    # flows is an array('d') in graph edge order
+    def get(self, key):
+        row = self.db.execute('SELECT flows, deficits FROM results '
+                              'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute('UPDATE results SET used = (SELECT MAX(used) + 1 '
+                        'FROM results) WHERE key = ?', (key,))
+        self.db.commit()
+        flows = array('d')
+        flows.frombytes(row[0])
+        return flows, json.loads(row[1])
+
+    # store an entry, evicting old ones if needed
+    def put(self, key, flows, deficits):
+        blob = array('d', flows).tobytes()
+        text = json.dumps(deficits)
+        self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+        self.db.execute('INSERT INTO results VALUES (?, ?, ?, ?, '
+                        '(SELECT COALESCE(MAX(used), 0) + 1 FROM results))',
+                        (key, blob, text, len(blob) + len(text)))
+        self.evict()
+        self.db.commit()
+
+    # drop least recently used entries until the cache fits in max_bytes
+    # this only reads the running total unless the cache is over the limit,
+    #   and then only fetches the oldest entries, a few at a time
+    def evict(self, chunk=64):
+        total = self.db.execute('SELECT total FROM usage').fetchone()[0]
+        while total > self.max_bytes:
+            rows = self.db.execute('SELECT key, size FROM results '
+                                   'ORDER BY used LIMIT ?',
+                                   (chunk,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                total -= size
+
+    # solve a graph, or read its flows back from the cache
+    # on a hit, the cached flows are written onto the graph's edges as
+    #   though it had been solved; the graph's deficits are not restored,
+    #   so use the returned deficits instead of graph.deficits()
+    # in water-quality mode, an entry's flows are followed by the pollution
+    #   index of every reach, and a hit writes the mixed ones back too
+    # returns (flows indexed by edge name, deficits indexed by node name)
+    def solve(self, graph, strict=True):
+        key = fingerprint(graph, strict)
+        edges = [edge for val in graph.edges.values() for edge, _ in val]
+        entry = self.get(key)
+        if entry is not None:
+            values, deficits = entry
+            for edge, flow in zip(edges, values):
+                edge.flow = flow
+            if graph.mixing:
+                for edge, pollution in zip(edges, values[len(edges):]):
+                    if not edge.root and pollution != edge.pollution:
+                        graph.base_pollution.setdefault(edge.name,
+                                                        edge.pollution)
+                        edge.pollution = pollution
+            graph.solved = {}
+            graph.dirty = set()
+            return dict((e.name, e.flow) for e in edges), deficits
+
+        result = graph.solve(strict)
+        deficits = graph.deficits()
+        values = [edge.flow for edge in edges]
+        if graph.mixing:
+            values += [edge.pollution for edge in edges]
+        self.put(key, values, deficits)
+        return result, deficits
+
+    def clear(self):
+        self.db.execute('DELETE FROM results')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,351 @@
+# compact, array-backed form of a network.Graph for fast repeated solves
+
+from array import array
+
+from network import SupplyError
+
+class CompiledGraph(object):
+    # a CompiledGraph is a frozen copy of a Graph's topology and parameters
+    # nodes are numbered in topological order, edges in the Graph's order
+    # everything a solve needs lives in flat arrays, so the solver kernel
+    # never touches Node or Edge objects or does any dictionary lookups
+
+    # constructor takes:
+    #   a built network.Graph, with its root reaches already set
+    def __init__(self, graph):
+        order = graph.topological_order()
+        self.node_names = [node.name for node in order]
+        self.node_id = dict((name, i) for i, name in enumerate(self.node_names))
+
+        edges = [(e, src, dst) for src, val in graph.edges.items()
+                               for e, dst in val]
+        self.edge_names = [e.name for e, _, _ in edges]
+        self.edge_id = dict((name, i) for i, name in enumerate(self.edge_names))
+        self.edge_src = array('l', [self.node_id[src] for _, src, _ in edges])
+        self.edge_dst = array('l', [self.node_id[dst] for _, _, dst in edges])
+
+        # CSR-style index arrays: the inflows of node i are
+        #   in_idx[in_ptr[i]:in_ptr[i + 1]], and likewise for outflows
+        # inflows keep the Graph's order so sums match Graph.solve exactly
+        self.in_ptr, self.in_idx = array('l', [0]), array('l')
+        self.out_ptr, self.out_idx = array('l', [0]), array('l')
+        for node in order:
+            self.in_idx.extend(self.edge_id[e.name]
+                               for e in graph.inflows[node.name])
+            self.in_ptr.append(len(self.in_idx))
+            self.out_idx.extend(self.edge_id[e.name]
+                                for e, _ in graph.edges[node.name])
+            self.out_ptr.append(len(self.out_idx))
+
+        self.refresh(graph)
+
+    # re-read demands, pollution indices, root flags, weights and flows from
+    # the Graph's objects; the topology must not have changed since compiling
+    def refresh(self, graph):
+        by_edge = dict((e.name, e) for val in graph.edges.values()
+                                   for e, _ in val)
+        edges = [by_edge[name] for name in self.edge_names]
+        self.demand = array('d', [graph.get_node(name).demand
+                                  for name in self.node_names])
+        self.flow = array('d', [e.flow for e in edges])
+        self.pollution = array('d', [e.pollution for e in edges])
+        self.root = array('b', [e.root for e in edges])
+        self.weight = array('d', [e.weight for e in edges])
+
+        # each node's inflows in drawing order, laid out like in_idx
+        # solves with the compiled pollution indices use this instead of
+        #   sorting every node's inflows again
+        self.ranked = array('l')
+        for i in range(len(self.node_names)):
+            self.ranked.extend(sorted(self.in_idx[self.in_ptr[i]:
+                                                  self.in_ptr[i + 1]],
+                                      key=self.pollution.__getitem__))
+
+        # total routing weight of each node's outflows
+        self.out_weight = array('d', [sum(self.weight[e] for e
+            in self.out_idx[self.out_ptr[i]:self.out_ptr[i + 1]])
+            for i in range(len(self.node_names))])
+
+        # only nodes with a non-root outflow have anything to solve
+        self.active = array('l', [i for i in range(len(self.node_names))
+            if any(not self.root[e]
+                   for e in self.out_idx[self.out_ptr[i]:self.out_ptr[i + 1]])])
+
+    # the arrays that make up a CompiledGraph, besides its names
+    arrays = ('edge_src', 'edge_dst', 'in_ptr', 'in_idx', 'out_ptr',
+              'out_idx', 'demand', 'flow', 'pollution', 'root', 'weight',
+              'ranked', 'out_weight', 'active')
+
+    # the flat form of this CompiledGraph, for saving without pickling
+    #   any objects: (node names, edge names, arrays by attribute name)
+    def flat(self):
+        return (self.node_names, self.edge_names,
+                dict((name, getattr(self, name)) for name in self.arrays))
+
+    # rebuild a CompiledGraph from its flat form, without a Graph
+    @classmethod
+    def from_flat(cls, node_names, edge_names, arrays):
+        self = cls.__new__(cls)
+        self.node_names = node_names
+        self.node_id = dict((name, i) for i, name in enumerate(node_names))
+        self.edge_names = edge_names
+        self.edge_id = dict((name, i) for i, name in enumerate(edge_names))
+        for name in cls.arrays:
+            setattr(self, name, arrays[name])
+        return self
+
+    # copy solved flows back onto the Graph's Edge objects
+    def write_back(self, graph, flow):
+        for val in graph.edges.values():
+            for e, _ in val:
+                e.flow = flow[self.edge_id[e.name]]
+
+    # flows indexed by edge name, like Graph.solve returns
+    def flows(self, flow):
+        return dict(zip(self.edge_names, flow))
+
+    # indices of the nodes whose demand can change a reach's flow: the
+    # reach's source and everything upstream of it through non-root reaches
+    def upstream(self, name):
+        found = set()
+        pending = [self.edge_src[self.edge_id[name]]]
+        while pending:
+            i = pending.pop()
+            if i in found:
+                continue
+            found.add(i)
+            pending += [self.edge_src[e]
+                        for e in self.in_idx[self.in_ptr[i]:self.in_ptr[i + 1]]
+                        if not self.root[e]]
+        return sorted(found)
+
+    # build the SupplyError for node i, which ran dry with D left unmet
+    def supply_error(self, i, demand, D, inflows, flow, pollution):
+        return SupplyError(self.node_names[i], demand, D,
+                           [(self.edge_names[e], flow[e], pollution[e])
+                            for e in inflows])
+
+    # solve every reach in one pass over the arrays
+    # demand, pollution and flow default to the compiled parameters
+    # only the root entries of flow are read; returns a new flow array
+    # if not strict, nodes that run dry take what they can instead of
+    #   raising a SupplyError, and (flow, deficit) is returned, where
+    #   deficit holds each node's unmet demand (0 where it was met)
+    def solve(self, demand=None, pollution=None, flow=None, strict=True):
+        demand = self.demand if demand is None else demand
+        pollution = self.pollution if pollution is None else pollution
+        flow = array('d', self.flow if flow is None else flow)
+        deficit = None
+        if not strict:
+            deficit = array('d', [0.0] * len(self.node_names))
+        self.solve_nodes(self.active, demand, pollution, flow, deficit)
+        if not strict:
+            return flow, deficit
+        return flow
+
+    # solve the given nodes, in order, writing their outflows into flow
+    # demand, pollution, flow and deficit only need to be indexable by the
+    #   ids of those nodes and their reaches, so dictionaries will do
+    # if deficit is None, a node that runs dry raises a SupplyError;
+    #   otherwise its unmet demand is stored there
+    def solve_nodes(self, nodes, demand, pollution, flow, deficit=None):
+        root, weight = self.root, self.weight
+        in_ptr, in_idx = self.in_ptr, self.in_idx
+        out_ptr, out_idx = self.out_ptr, self.out_idx
+        shared = pollution is self.pollution
+        for i in nodes:
+            inflows = in_idx[in_ptr[i]:in_ptr[i + 1]]
+            if shared:
+                ranked = self.ranked[in_ptr[i]:in_ptr[i + 1]]
+            else:
+                ranked = sorted(inflows, key=pollution.__getitem__)
+
+            # same draw logic as network.draw_inflows
+            D = demand[i]
+            supply = 0
+            total_draw = 0
+            for e in inflows:
+                supply += flow[e]
+            for e in ranked:
+                pol = pollution[e]
+                draw = min(flow[e], D / pol)
+                D = D - draw * pol
+                total_draw += draw
+            net_outflow = supply - total_draw
+
+            if net_outflow < 0 or D > 1:
+                if deficit is None:
+                    raise self.supply_error(i, demand[i], D, inflows, flow,
+                                            pollution)
+                if D > 1:
+                    deficit[i] = D
+                net_outflow = max(net_outflow, 0)
+
+            total_weight = self.out_weight[i]
+            for e in out_idx[out_ptr[i]:out_ptr[i + 1]]:
+                if not root[e]:
+                    flow[e] = net_outflow * weight[e] / total_weight
+
+    # solve a batch of N scenarios in one pass over the topology
+    # each argument is a list of N rows, or None to use the compiled values:
+    #   demand: per-node demands, shape (N, nodes)
+    #   pollution: per-reach pollution indices, shape (N, edges)
+    #   inflow: per-reach flows, shape (N, edges); only root entries are read
+    # the outer loop runs over nodes and the inner loop over scenarios,
+    # so index lookups and shared sort orders are paid once per node
+    # returns the solved flows, shape (N, edges)
+    # if not strict, returns (flows, deficits) instead, with deficits of
+    #   shape (N, nodes) holding unmet demands, as in solve
+    def solve_batch(self, demand=None, pollution=None, inflow=None,
+                    strict=True):
+        sizes = set(len(rows) for rows in (demand, pollution, inflow)
+                    if rows is not None)
+        if len(sizes) != 1:
+            raise Exception('Batch needs at least one argument, all of one size')
+        n = sizes.pop()
+
+        demand = [self.demand] * n if demand is None else demand
+        flows = [array('d', self.flow if inflow is None else row)
+                 for row in (inflow or [None] * n)]
+        scenarios = list(zip(demand, flows))
+        if not strict:
+            deficits = [array('d', [0.0] * len(self.node_names))
+                        for _ in range(n)]
+
+        root = self.root
+        in_ptr, in_idx = self.in_ptr, self.in_idx
+        out_ptr, out_idx = self.out_ptr, self.out_idx
+        for i in self.active:
+            inflows = in_idx[in_ptr[i]:in_ptr[i + 1]]
+            total_weight = self.out_weight[i]
+            outflows = [(e, self.weight[e])
+                        for e in out_idx[out_ptr[i]:out_ptr[i + 1]]
+                        if not root[e]]
+
+            # with shared pollution indices, the draw order is shared too
+            if pollution is None:
+                draws = [(e, self.pollution[e])
+                         for e in self.ranked[in_ptr[i]:in_ptr[i + 1]]]
+
+            for s, (dem, flow) in enumerate(scenarios):
+                if pollution is not None:
+                    pol = pollution[s]
+                    draws = [(e, pol[e])
+                             for e in sorted(inflows, key=pol.__getitem__)]
+
+                D = dem[i]
+                supply = 0
+                total_draw = 0
+                for e in inflows:
+                    supply += flow[e]
+                for e, p in draws:
+                    draw = min(flow[e], D / p)
+                    D = D - draw * p
+                    total_draw += draw
+                net_outflow = supply - total_draw
+
+                if net_outflow < 0 or D > 1:
+                    if strict:
+                        err = self.supply_error(i, dem[i], D, inflows, flow,
+                                                self.pollution
+                                                if pollution is None
+                                                else pollution[s])
+                        err.scenario = s
+                        raise err
+                    if D > 1:
+                        deficits[s][i] = D
+                    net_outflow = max(net_outflow, 0)
+
+                for e, w in outflows:
+                    flow[e] = net_outflow * w / total_weight
+        if not strict:
+            return flows, deficits
+        return flows
+
+    # solve like solve(), but also record how every node drew its demand
+    # returns (flow, tape), where the tape lists, for each solved node,
+    #   (node, [(inflow edge, demand left before the draw, whether the
+    #   whole inflow was drawn)]) in solve order
+    def record(self, demand=None, pollution=None, flow=None):
+        demand = self.demand if demand is None else demand
+        pollution = self.pollution if pollution is None else pollution
+        flow = array('d', self.flow if flow is None else flow)
+
+        tape = []
+        for i in self.active:
+            inflows = self.in_idx[self.in_ptr[i]:self.in_ptr[i + 1]]
+            D = demand[i]
+            steps = []
+            total_draw = 0
+            for e in sorted(inflows, key=pollution.__getitem__):
+                pol = pollution[e]
+                whole = flow[e] <= D / pol
+                draw = flow[e] if whole else D / pol
+                steps += [(e, D, whole)]
+                D = D - draw * pol
+                total_draw += draw
+            net_outflow = sum(flow[e] for e in inflows) - total_draw
+
+            if net_outflow < 0 or D > 1:
+                raise self.supply_error(i, demand[i], D, inflows, flow,
+                                        pollution)
+
+            total_weight = self.out_weight[i]
+            for e in self.out_idx[self.out_ptr[i]:self.out_ptr[i + 1]]:
+                if not self.root[e]:
+                    flow[e] = net_outflow * self.weight[e] / total_weight
+            tape += [(i, steps)]
+        return flow, tape
+
+    # differentiate the flow of one reach by a backward pass over a tape
+    # the draw logic is piecewise linear, so these are exact derivatives
+    #   within the current draw regime of every node; where two inflows
+    #   share a pollution index, they are one-sided, for the current order
+    # takes the (flow, tape) from record, the target edge name, and the
+    #   pollution indices that were used to record it
+    # returns (d_demand per node, d_pollution per edge, d_flow per edge);
+    #   d_flow of a root reach is the sensitivity to that root inflow
+    def backward(self, recorded, target, pollution=None):
+        pollution = self.pollution if pollution is None else pollution
+        flow, tape = recorded
+        d_demand = array('d', [0.0] * len(self.node_names))
+        d_pollution = array('d', [0.0] * len(self.edge_names))
+        d_flow = array('d', [0.0] * len(self.edge_names))
+        d_flow[self.edge_id[target]] = 1.0
+
+        for i, steps in reversed(tape):
+            outflows = self.out_idx[self.out_ptr[i]:self.out_ptr[i + 1]]
+            d_net = sum(d_flow[e] * self.weight[e] for e in outflows
+                        if not self.root[e]) / self.out_weight[i]
+            if d_net == 0:
+                continue
+
+            # net outflow is the sum of the inflows less the sum of draws
+            d_draw = -d_net
+            d_left = 0.0
+            for e, D, whole in reversed(steps):
+                pol = pollution[e]
+                if whole:
+                    # draw = v, left = D - v * p
+                    d_flow[e] += d_net + d_draw - d_left * pol
+                    d_pollution[e] -= d_left * flow[e]
+                else:
+                    # draw = D / p, and nothing is left
+                    d_flow[e] += d_net
+                    d_pollution[e] -= d_draw * D / (pol * pol)
+                    d_left = d_draw / pol
+            d_demand[i] = d_left
+        return d_demand, d_pollution, d_flow
+
+    # derivatives of one reach's flow by node demands, pollution indices
+    # and flows, from one forward and one backward pass
+    def gradient(self, target, demand=None, pollution=None, flow=None):
+        return self.backward(self.record(demand, pollution, flow), target,
+                             pollution)
+
+    # derivatives of every reach's flow, from one forward pass and one
+    # backward pass per reach; returns gradients indexed by edge name
+    def jacobian(self, demand=None, pollution=None, flow=None):
+        recorded = self.record(demand, pollution, flow)
+        return dict((name, self.backward(recorded, name, pollution))
+                    for name in self.edge_names)
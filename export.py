@@ -0,0 +1,126 @@
+# bulk export of model results
+# the CSV, JSON Lines and scenario writers make a single pass and write
+# straight to an open file, so nothing larger than one row is built in
+# memory; write_npz is the exception, since each .npy member is a whole
+# column, and it holds every column before writing the archive
+
+import csv
+import json
+import struct
+import zipfile
+from array import array
+
+# columns shared by the CSV and JSON Lines graph exports
+# nodes fill in demand, reaches fill in the rest
+COLUMNS = ['kind', 'name', 'demand', 'flow', 'pollution', 'source',
+           'destination']
+
+# one record per Node and per Edge of a Graph, in report order
+def records(graph):
+    for node in graph.nodes:
+        yield {'kind': 'node', 'name': node.name, 'demand': node.demand}
+        for reach, dst_name in graph.edges[node.name]:
+            yield {'kind': 'reach', 'name': reach.name, 'flow': reach.flow,
+                   'pollution': reach.pollution, 'source': node.name,
+                   'destination': dst_name}
+
+# write node demands and reach flows as CSV
+# f should be opened with newline=''
+def write_csv(graph, f):
+    writer = csv.DictWriter(f, COLUMNS)
+    writer.writeheader()
+    writer.writerows(records(graph))
+
+# write node demands and reach flows as JSON Lines
+def write_jsonl(graph, f):
+    for record in records(graph):
+        f.write(json.dumps(record) + '\n')
+
+# write a column of values as a .npy array into an open zip file
+# the format is simple enough that NumPy is not needed to write it:
+#   https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+# columns of floats, ints or strings are supported
+def write_npy(zf, name, values):
+    if all(isinstance(v, str) for v in values):
+        width = max([len(v) for v in values] + [1])
+        descr = '<U%d' % width
+        data = b''.join(v.ljust(width, '\0').encode('utf-32-le')
+                        for v in values)
+    elif all(isinstance(v, int) for v in values):
+        descr = '<i8'
+        data = struct.pack('<%dq' % len(values), *values)
+    else:
+        descr = '<f8'
+        data = struct.pack('<%dd' % len(values), *values)
+
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" \
+             % (descr, len(values))
+    # magic, version and header length take 10 bytes; pad the whole
+    # preamble to a multiple of 64 bytes, ending in a newline
+    header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+    with zf.open(name + '.npy', 'w') as out:
+        out.write(b'\x93NUMPY\x01\x00')
+        out.write(struct.pack('<H', len(header)))
+        out.write(header.encode('latin1'))
+        out.write(data)
+
+# write node demands and reach flows as a NumPy .npz archive
+# the arrays are node_names, demand, reach_names, flow, pollution,
+#   source and destination, loadable with numpy.load
+def write_npz(graph, f):
+    node_names, demand = [], array('d')
+    reach_names, flow, pollution = [], array('d'), array('d')
+    source, destination = [], []
+    for record in records(graph):
+        if record['kind'] == 'node':
+            node_names += [record['name']]
+            demand.append(record['demand'])
+        else:
+            reach_names += [record['name']]
+            flow.append(record['flow'])
+            pollution.append(record['pollution'])
+            source += [record['source']]
+            destination += [record['destination']]
+
+    with zipfile.ZipFile(f, 'w') as zf:
+        write_npy(zf, 'node_names', node_names)
+        write_npy(zf, 'demand', demand)
+        write_npy(zf, 'reach_names', reach_names)
+        write_npy(zf, 'flow', flow)
+        write_npy(zf, 'pollution', pollution)
+        write_npy(zf, 'source', source)
+        write_npy(zf, 'destination', destination)
+
+# write the flows of many scenarios as CSV, one row per scenario
+# takes the reach names and an iterable of (scenario label, flows) pairs,
+#   e.g. the rows of a sweep as they are solved
+def write_scenarios_csv(f, reach_names, scenarios):
+    writer = csv.writer(f)
+    writer.writerow(['scenario'] + list(reach_names))
+    for label, flow in scenarios:
+        writer.writerow([label] + list(flow))
+
+# write the flows of many scenarios as JSON Lines, one line per scenario
+def write_scenarios_jsonl(f, reach_names, scenarios):
+    for label, flow in scenarios:
+        f.write(json.dumps({'scenario': label,
+                            'flows': dict(zip(reach_names, flow))}) + '\n')
+
+# exporters by file extension
+writers = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'npz': write_npz
+}
+
+# export a Graph to a file, picking the format from the extension
+def export(graph, path):
+    kind = path.rsplit('.', 1)[-1]
+    if kind not in writers:
+        raise Exception('Unknown export format [%s]' % kind)
+    if kind == 'npz':
+        with open(path, 'wb') as f:
+            write_npz(graph, f)
+    else:
+        with open(path, 'w', newline='') as f:
+            writers[kind](graph, f)
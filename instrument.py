@@ -0,0 +1,103 @@
+# optional instrumentation for Graph solves
+# attach a SolveTrace with graph.trace = SolveTrace(); detach with None
+# nothing is recorded, and nothing extra is paid, while graph.trace is None
+
+import json
+import time
+
+class SolveTrace(object):
+    # a SolveTrace records what the solver did during one or more solves:
+    #   visits: times each Node was solved, indexed by node name
+    #   hits, misses: reaches (get_flow) or Nodes (resolve) whose result
+    #     was already known, versus ones that had to be computed
+    #   times: total seconds spent solving each Node
+    #     get_flow recurses, so this includes time spent upstream
+    #   draws: the last draw breakdown of each Node, as a list of
+    #     (edge name, inflow, pollution, draw) in pollution order
+    #   shortfall: the SupplyError of the last Node that ran dry, if any
+
+    def __init__(self):
+        self.visits = {}
+        self.hits = 0
+        self.misses = 0
+        self.times = {}
+        self.draws = {}
+        self.shortfall = None
+
+        self.events = []   # Chrome trace events, in microseconds
+        self.stack = []    # start times of the Nodes being solved
+        self.epoch = time.perf_counter()
+
+    def hit(self, name):
+        self.hits += 1
+
+    def miss(self, name):
+        self.misses += 1
+
+    # a Node is about to be solved
+    def begin(self, name):
+        now = time.perf_counter()
+        self.stack += [now]
+        self.visits[name] = self.visits.get(name, 0) + 1
+        self.events += [{'name': name, 'ph': 'B', 'pid': 0, 'tid': 0,
+                         'ts': (now - self.epoch) * 1e6}]
+
+    # a Node has been solved
+    # takes the inflow Edges, their volumes and the draw_inflows breakdown
+    def end(self, name, inflows, vol_inflows, breakdown):
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0) + now - self.stack.pop()
+        self.draws[name] = [(inflows[k].name, vol_inflows[k],
+                             inflows[k].pollution, draw)
+                            for k, draw in breakdown]
+        self.events += [{'name': name, 'ph': 'E', 'pid': 0, 'tid': 0,
+                         'ts': (now - self.epoch) * 1e6,
+                         'args': {'draws': self.draws[name]}}]
+
+    # a Node was abandoned because something upstream of it ran dry
+    def abort(self, name):
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0) + now - self.stack.pop()
+        self.events += [{'name': name, 'ph': 'E', 'pid': 0, 'tid': 0,
+                         'ts': (now - self.epoch) * 1e6,
+                         'args': {'aborted': True}}]
+
+    # a Node has run dry
+    def fail(self, err):
+        self.shortfall = err
+
+    # the n Nodes that took the most time, slowest first
+    def bottlenecks(self, n=10):
+        return sorted(self.times.items(), key=lambda x: x[1],
+                      reverse=True)[:n]
+
+    # everything recorded, as plain data
+    def summary(self):
+        shortfall = None
+        if self.shortfall is not None:
+            err = self.shortfall
+            shortfall = {
+                'node': err.node,
+                'demand': err.demand,
+                'excess': err.excess,
+                'inflows': err.inflows,
+                'chain': err.chain
+            }
+        return {
+            'visits': self.visits,
+            'hits': self.hits,
+            'misses': self.misses,
+            'times': self.times,
+            'draws': self.draws,
+            'shortfall': shortfall
+        }
+
+    # export the trace in the Chrome trace event format, which can be
+    # loaded into chrome://tracing, Perfetto or speedscope
+    def to_chrome(self):
+        return {'traceEvents': self.events, 'otherData': self.summary()}
+
+    # write the Chrome trace to a file
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome(), f)
@@ -1,16 +1,24 @@
 # the actual math model
 
+# models are built lazily, on first access, by get_model
+# the old module-level names (KharifGangesModel, KharifRivers, ...) still
+# work and are built the first time they are imported
+
 from network import UrbArea, Node, Edge, Graph
-from crops import CropPattern, KharifCrops, RabiCrops
+import crops
 
-# cities --- exist for both models
-U2 = UrbArea('U-2', 2765348)  # Kanpur
-U3 = UrbArea('U-3', 1112544)  # Allahabad
-U4 = UrbArea('U-4', 2817105)  # Lucknow
-U5 = UrbArea('U-5', 1198461)  # Varanasi
+# base nodes --- exist for both models
+# built per model, so the seasons never share mutable Nodes
+class BaseNodes(object):
+    def __init__(self):
+        # cities
+        self.U2 = UrbArea('U-2', 2765348)  # Kanpur
+        self.U3 = UrbArea('U-3', 1112544)  # Allahabad
+        self.U4 = UrbArea('U-4', 2817105)  # Lucknow
+        self.U5 = UrbArea('U-5', 1198461)  # Varanasi
 
-# dummy source/destination node for external flow
-EXTERN = Node('EXTERN', 'none', 0, 0)
+        # dummy source/destination node for external flow
+        self.EXTERN = Node('EXTERN', 'none', 0, 0)
 
 # base river reaches --- exist for both models
 class BaseRivers(object):
@@ -51,7 +59,10 @@ class BaseRivers(object):
 
 # generate a generic Ganges basin network topology
 # accepts a cropping season as the input
-def populate_network(model, Crops, Rivers):
+def populate_network(model, Crops, Rivers, Nodes):
+    U2, U3, U4, U5 = Nodes.U2, Nodes.U3, Nodes.U4, Nodes.U5
+    EXTERN = Nodes.EXTERN
+
     # add the irrigation districts and urban areas as nodes
     model.add_nodes_from_list([
         Crops.A, Crops.B, Crops.C, Crops.D, Crops.E, Crops.F, Crops.G,
@@ -110,42 +121,83 @@ def populate_network(model, Crops, Rivers):
     pop_density = 66308416.96 / total_area
     model.apply_area_offset(pop_density * Node.scarcity_threshold / 1000000)
 
-# Kharif season model
-KharifRivers = BaseRivers()
-KharifRivers.Y1.flow = 93094.92
-KharifRivers.Ga0.flow = 525370.9248
-KharifRivers.Gh0.flow = 946728
-KharifRivers.K2.flow = 9800
-KharifRivers.B2.flow = 21000
-KharifRivers.S1.flow = 5000
-KharifRivers.C2.flow = 5000
-KharifRivers.Ag1.flow = 5000
-
-KharifGangesModel = Graph()
-populate_network(KharifGangesModel, KharifCrops, KharifRivers)
-KharifGangesModel.set_root()
-
-# Rabi season model
-RabiRivers = BaseRivers()
-RabiRivers.Y1.flow = 93094.92
-RabiRivers.Ga0.flow = 525370
-RabiRivers.Gh0.flow = 24357.224
-RabiRivers.K2.flow = 9800
-RabiRivers.B2.flow = 21000
-RabiRivers.S1.flow = 5000
-RabiRivers.C2.flow = 5000
-RabiRivers.Ag1.flow = 5000
-
-RabiGangesModel = Graph()
-populate_network(RabiGangesModel, RabiCrops, RabiRivers)
-RabiGangesModel.set_root()
+# build a fresh Kharif season model
+# returns (graph, crops, rivers)
+def build_kharif():
+    rivers = BaseRivers()
+    rivers.Y1.flow = 93094.92
+    rivers.Ga0.flow = 525370.9248
+    rivers.Gh0.flow = 946728
+    rivers.K2.flow = 9800
+    rivers.B2.flow = 21000
+    rivers.S1.flow = 5000
+    rivers.C2.flow = 5000
+    rivers.Ag1.flow = 5000
+
+    pattern = crops.KharifCrops()
+    graph = Graph()
+    populate_network(graph, pattern, rivers, BaseNodes())
+    graph.set_root()
+    return graph, pattern, rivers
+
+# build a fresh Rabi season model
+# returns (graph, crops, rivers)
+def build_rabi():
+    rivers = BaseRivers()
+    rivers.Y1.flow = 93094.92
+    rivers.Ga0.flow = 525370
+    rivers.Gh0.flow = 24357.224
+    rivers.K2.flow = 9800
+    rivers.B2.flow = 21000
+    rivers.S1.flow = 5000
+    rivers.C2.flow = 5000
+    rivers.Ag1.flow = 5000
+
+    pattern = crops.RabiCrops()
+    graph = Graph()
+    populate_network(graph, pattern, rivers, BaseNodes())
+    graph.set_root()
+    return graph, pattern, rivers
+
+builders = {'kharif': build_kharif, 'rabi': build_rabi}
+models = {}  # shared models, indexed by season
+
+# get a season's (graph, crops, rivers), building it on first access
+# the shared model is returned unless fresh is set, in which case a new,
+# unshared model is built every time
+def get_model(season, fresh=False):
+    if season not in builders:
+        raise Exception('Unknown season [%s]' % season)
+    if fresh:
+        return builders[season]()
+    if season not in models:
+        models[season] = builders[season]()
+    return models[season]
+
+# old module-level names, mapped to (season, index into get_model)
+legacy_names = {
+    'KharifGangesModel': ('kharif', 0),
+    'KharifCrops': ('kharif', 1),
+    'KharifRivers': ('kharif', 2),
+    'RabiGangesModel': ('rabi', 0),
+    'RabiCrops': ('rabi', 1),
+    'RabiRivers': ('rabi', 2)
+}
+
+# build the old module-level names lazily when they are first imported
+def __getattr__(name):
+    if name in legacy_names:
+        season, i = legacy_names[name]
+        return get_model(season)[i]
+    raise AttributeError("module 'model' has no attribute '%s'" % name)
 
 if __name__ == '__main__':
+    KharifGangesModel = get_model('kharif')[0]
     print('=== Kharif Season Simulation ===')
-    KharifGangesModel.get_flow(KharifRivers.OUT)
+    KharifGangesModel.solve()
     print(KharifGangesModel.report())
     # print()
     # print('=== Rabi Season Simulation ===')
-    # RabiGangesModel.get_flow(RabiRivers.OUT)
+    # RabiGangesModel = get_model('rabi')[0]
+    # RabiGangesModel.solve()
     # print(RabiGangesModel.report())
-
@@ -0,0 +1,276 @@
+# streaming Monte Carlo uncertainty analysis
+# draws are solved in chunks with CompiledGraph.solve_batch, and per-reach
+# statistics are kept online, so memory does not grow with the sample count
+
+import math
+import os
+import pickle
+import random
+from array import array
+
+from compiled import CompiledGraph
+from network import Node
+
+class P2Quantile(object):
+    # streaming estimate of a single quantile, using the P-squared
+    # algorithm of Jain and Chlamtac (1985)
+    # only five markers are kept, however many values are added
+
+    # constructor takes:
+    #   the quantile to estimate, between 0 and 1 (float)
+    def __init__(self, p):
+        self.p = p
+        self.q = []                                      # marker heights
+        self.n = [1, 2, 3, 4, 5]                         # marker positions
+        self.want = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q, n = self.q, self.n
+
+        # the first five values are just kept, in order
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # find the cell x falls in, stretching the ends if needed
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.want[i] += self.step[i]
+
+        # nudge the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.want[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+               (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                guess = q[i] + d / (n[i + 1] - n[i - 1]) * \
+                    ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i])
+                     / (n[i + 1] - n[i]) +
+                     (n[i + 1] - n[i] - d) * (q[i] - q[i - 1])
+                     / (n[i] - n[i - 1]))
+                if not q[i - 1] < guess < q[i + 1]:
+                    guess = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = guess
+                n[i] += d
+
+    def value(self):
+        if not self.q:
+            return math.nan
+        if len(self.q) < 5:
+            return self.q[int(round(self.p * (len(self.q) - 1)))]
+        return self.q[2]
+
+class MonteCarlo(object):
+    # a MonteCarlo run samples uncertain inputs and tracks the statistics
+    # of every reach's flow: mean and variance by Welford's method, and
+    # quantiles by P-squared estimators
+    # draws are solved in shortfall-tolerant mode, so a draw where some
+    # node runs dry still counts; each node's unmet demand is tracked too
+
+    # constructor takes:
+    #   a built network.Graph, with its root reaches already set
+    #   spec: the uncertain inputs, as a dictionary with any of the keys
+    #     'flows': {root reach name: distribution}
+    #     'pollution': {reach name: distribution}
+    #     'rainfall': distribution
+    #     'population': distribution
+    #   rainfall: the rainfall already applied to the graph, in m / year
+    #   quantiles: the flow quantiles to estimate
+    #   chunk: number of draws solved per batch
+    #   seed: random seed
+    # a distribution is a tuple naming a random.Random method and its
+    #   parameters, e.g. ('uniform', 0.9, 1.1) or ('gauss', 1, 0.05)
+    # every draw is a multiplier on the graph's base value; pollution
+    #   indices are capped at 1
+    def __init__(self, graph, spec, rainfall=0, quantiles=(0.05, 0.5, 0.95),
+                 chunk=1000, seed=0):
+        self.compiled = CompiledGraph(graph)
+        self.spec = spec
+        self.rainfall = rainfall
+        self.chunk = chunk
+
+        nodes = [graph.get_node(name) for name in self.compiled.node_names]
+        self.area = array('d', [node.area for node in nodes])
+        self.urban = array('d', [node.population * Node.scarcity_threshold
+                                 / 1000000 for node in nodes])
+
+        edge_id = self.compiled.edge_id
+        self.flow_dists = [(edge_id[name], dist) for name, dist
+                           in spec.get('flows', {}).items()]
+        self.pol_dists = [(edge_id[name], dist) for name, dist
+                          in spec.get('pollution', {}).items()]
+
+        # everything below here is the resumable state of the run
+        self.rng = random.Random(seed)
+        self.drawn = 0       # draws taken
+        self.count = 0       # draws folded into the statistics
+        self.failures = 0    # draws where some node ran dry
+        edges = len(self.compiled.edge_names)
+        self.mean = array('d', [0.0] * edges)
+        self.m2 = array('d', [0.0] * edges)
+        self.quantiles = [[P2Quantile(p) for p in quantiles]
+                          for _ in range(edges)]
+        nodes = len(self.compiled.node_names)
+        self.deficit_mean = array('d', [0.0] * nodes)
+        self.dry = array('l', [0] * nodes)   # draws where each node ran dry
+
+    # take one draw from a distribution
+    def sample(self, dist):
+        return getattr(self.rng, dist[0])(*dist[1:])
+
+    # build the (demand, pollution, inflow) rows for one draw
+    def draw(self):
+        c = self.compiled
+        demand = c.demand
+        if 'rainfall' in self.spec or 'population' in self.spec:
+            demand = array('d', demand)
+        if 'rainfall' in self.spec:
+            # less rain than the base case means more demand
+            rain = self.rainfall * (1 - self.sample(self.spec['rainfall']))
+            for i, area in enumerate(self.area):
+                demand[i] += area * rain
+        if 'population' in self.spec:
+            scale = self.sample(self.spec['population']) - 1
+            for i, urban in enumerate(self.urban):
+                demand[i] += urban * scale
+
+        flow = array('d', c.flow)
+        for e, dist in self.flow_dists:
+            flow[e] *= self.sample(dist)
+
+        pollution = None
+        if self.pol_dists:
+            pollution = array('d', c.pollution)
+            for e, dist in self.pol_dists:
+                pollution[e] = min(pollution[e] * self.sample(dist), 1)
+        return demand, pollution, flow
+
+    # fold one solved draw into the running statistics
+    def add(self, flow, deficit):
+        self.count += 1
+        if any(deficit):
+            self.failures += 1
+        for i, unmet in enumerate(deficit):
+            self.deficit_mean[i] += (unmet - self.deficit_mean[i]) / self.count
+            if unmet:
+                self.dry[i] += 1
+
+        mean, m2 = self.mean, self.m2
+        for e, x in enumerate(flow):
+            delta = x - mean[e]
+            mean[e] += delta / self.count
+            m2[e] += delta * (x - mean[e])
+            for estimator in self.quantiles[e]:
+                estimator.add(x)
+
+    # solve one chunk of draws
+    def step(self, size):
+        draws = [self.draw() for _ in range(size)]
+        self.drawn += size
+        demand, pollution, flow = zip(*draws)
+        flows, deficits = self.compiled.solve_batch(
+            list(demand), None if pollution[0] is None else list(pollution),
+            list(flow), strict=False)
+        for flow, deficit in zip(flows, deficits):
+            self.add(flow, deficit)
+
+    # run until [samples] draws have been taken in total
+    # if a checkpoint path is given, the run resumes from it when it exists
+    #   and saves to it after every chunk
+    def run(self, samples, checkpoint=None):
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load(checkpoint)
+        while self.drawn < samples:
+            self.step(min(self.chunk, samples - self.drawn))
+            if checkpoint is not None:
+                self.save(checkpoint)
+        return self.summary()
+
+    # save the state of the run, atomically
+    def save(self, path):
+        state = {
+            'rng': self.rng.getstate(),
+            'drawn': self.drawn,
+            'count': self.count,
+            'failures': self.failures,
+            'deficit_mean': self.deficit_mean,
+            'dry': self.dry,
+            'mean': self.mean,
+            'm2': self.m2,
+            'quantiles': self.quantiles
+        }
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    # restore the state of a run saved with the same graph and spec
+    def load(self, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        self.rng.setstate(state['rng'])
+        self.drawn = state['drawn']
+        self.count = state['count']
+        self.failures = state['failures']
+        self.deficit_mean = state['deficit_mean']
+        self.dry = state['dry']
+        self.mean = state['mean']
+        self.m2 = state['m2']
+        self.quantiles = state['quantiles']
+
+    # per-reach statistics, indexed by edge name
+    def summary(self):
+        result = {}
+        for e, name in enumerate(self.compiled.edge_names):
+            variance = self.m2[e] / (self.count - 1) if self.count > 1 else 0
+            result[name] = {
+                'mean': self.mean[e],
+                'variance': variance,
+                'quantiles': dict((q.p, q.value())
+                                  for q in self.quantiles[e])
+            }
+        return result
+
+    # per-node shortfall statistics, indexed by node name: the mean unmet
+    # demand, and the fraction of draws where the node ran dry
+    def shortfalls(self):
+        return dict((name, {
+            'mean': self.deficit_mean[i],
+            'probability': self.dry[i] / self.count if self.count else 0
+        }) for i, name in enumerate(self.compiled.node_names))
+
+if __name__ == '__main__':
+    from model import get_model
+
+    graph, crops, rivers = get_model('kharif')
+    spec = {
+        'flows': dict((reach.name, ('uniform', 0.9, 1.1))
+                      for reach in vars(rivers).values() if reach.root),
+        'pollution': dict((reach.name, ('uniform', 0.95, 1.05))
+                          for reach in vars(rivers).values()),
+        'rainfall': ('gauss', 1, 0.05),
+        'population': ('uniform', 0.95, 1.05)
+    }
+    mc = MonteCarlo(graph, spec, rainfall=crops.rainfall)
+    result = mc.run(10000)
+    print('%d draws, %d with a shortfall' % (mc.drawn, mc.failures))
+    for name, stats in mc.shortfalls().items():
+        if stats['probability']:
+            print('%s: dry in %.2f%% of draws, mean deficit %f' % (
+                name, stats['probability'] * 100, stats['mean']))
+    for name, stats in result.items():
+        print('%s: mean %f, sd %f, 5%% %f, 95%% %f' % (
+            name, stats['mean'], math.sqrt(stats['variance']),
+            stats['quantiles'][0.05], stats['quantiles'][0.95]))
@@ -1,9 +1,16 @@
 # classes relating to the networked model
 
+from array import array
+from collections import deque
+
 class Node(object):
     # a Node object represents a hydrologic demand node
     # it combines agricultural and urban water use cases
 
+    # slots keep per-Node memory down for basins with many districts
+    __slots__ = ('name', '_crop', 'avg_crop_need', 'area', 'population',
+                 'demand')
+
     # crop water demands, in meters per growing cycle
     crop_needs = {
         'none':      0.00,
@@ -30,15 +37,30 @@ class Node(object):
 
         self.compute_demand()
 
+    # crop type (string), e.g. 'rice' or 'rice maize'
+    # setting it re-parses the crops and caches their average water need
+    @property
+    def crop(self):
+        return self._crop
+
+    @crop.setter
+    def crop(self, crop):
+        self.avg_crop_need = self.crop_need(crop)
+        self._crop = crop
+
+    # water need of a crop type, in meters per growing cycle
+    # if multiple crops are given, we average their water needs
+    @classmethod
+    def crop_need(cls, crop):
+        crops = crop.split(' ')
+        return sum([cls.crop_needs[c] for c in crops]) / len(crops)
+
     # separate so we can fiddle around and continuously recompute if needed
     # random coefficients to twiddle/implement policy alternatives
     def compute_demand(self, a=1, b=1):
         # compute water demand, in MCM / year
         # note that India uses half-year growing cycles, Kharif and Rabi
-        # if multiple crops are given, we average their water needs
-        crops = self.crop.split(' ')
-        avg_crop_need = sum([self.crop_needs[c] for c in crops]) / len(crops)
-        agricultural_demand = a * avg_crop_need * self.area * 2
+        agricultural_demand = a * self.avg_crop_need * self.area * 2
         urban_demand = b * self.population * self.scarcity_threshold / 1000000
         self.demand = agricultural_demand + urban_demand
         return self.demand
@@ -47,6 +69,8 @@ class IrrDistrict(Node):
     # an IrrDistrict is a pure irrigation district
     # i.e. it is modeled with no people
 
+    __slots__ = ()
+
     def __init__(self, name, crop, area):
         super().__init__(name, crop, area, 0)
 
@@ -54,22 +78,117 @@ class UrbArea(Node):
     # an UrbArea is a pure urban area
     # i.e. it is modeled with no crops
 
+    __slots__ = ()
+
     def __init__(self, name, population):
         super().__init__(name, 'none', 0, population)
 
 class Edge(object):
     # an Edge object represents a river reach
 
+    __slots__ = ('name', 'flow', 'pollution', 'root', 'weight')
+
     # constructor takes:
     #   identifying name (string)
     #   volume flow rate (MCM / year)
     #   pollution index, fraction of water that is usable (float)
+    #   routing weight, this reach's share of its source's net outflow
+    #     relative to the source's other outflows (float)
     # flow can be -1 if unknown
-    def __init__(self, name, flow, pollution):
+    # equal weights, the default, split a node's outflow evenly
+    def __init__(self, name, flow, pollution, weight=1):
         self.name = name
         self.flow = flow
         self.pollution = pollution
         self.root = False   # root nodes in the flow network
+        self.weight = weight
+
+class SupplyError(Exception):
+    # a SupplyError is raised when a Node's demand exceeds its inflows
+
+    # constructor takes:
+    #   name of the Node that ran dry (string)
+    #   original demand of the Node (float)
+    #   excess demand left after drawing all inflows (float)
+    #   inflows of the Node, as a list of (edge name, flow, pollution)
+    def __init__(self, node, demand, excess, inflows):
+        super().__init__('Water supply could not be solved at node [%s]'
+                         % node)
+        self.node = node
+        self.demand = demand
+        self.excess = excess
+        self.inflows = inflows
+        # reaches from the one out of this Node to the one that was asked for
+        self.chain = []
+
+    # rebuild from the constructor arguments, so the error (and anything
+    # added to it since, like chain) survives being sent between processes
+    def __reduce__(self):
+        return (self.__class__,
+                (self.node, self.demand, self.excess, self.inflows),
+                self.__dict__)
+
+    def __str__(self):
+        lines = [self.args[0],
+                 'original demand is %d' % self.demand,
+                 'excess demand is D = %d' % self.excess,
+                 'inflows are: %s' % ' '.join(['%s=%s' % (name, flow)
+                                              for name, flow, _
+                                              in self.inflows])]
+        if self.chain:
+            lines += ['reached through: %s' % ' => '.join(self.chain)]
+        return '\n'.join(lines)
+
+class GraphError(Exception):
+    # a GraphError is raised by Graph.compile when the network is miswired
+
+    # constructor takes:
+    #   every problem found, as a list of strings
+    def __init__(self, problems):
+        super().__init__('Graph is miswired: %d problem(s)' % len(problems))
+        self.problems = problems
+
+    def __reduce__(self):
+        return (self.__class__, (self.problems,), self.__dict__)
+
+    def __str__(self):
+        return '\n'.join([self.args[0]] +
+                         ['  %s' % problem for problem in self.problems])
+
+class Snapshot(object):
+    # a Snapshot is a copy of a Graph's mutable state, in flat arrays
+    # Nodes and Edges are stored in Graph order; see Graph.snapshot
+
+    __slots__ = ('demand', 'area', 'population', 'flow', 'pollution', 'root',
+                 'weight')
+
+    def __init__(self):
+        self.demand = array('d')
+        self.area = array('d')
+        self.population = array('d')
+        self.flow = array('d')
+        self.pollution = array('d')
+        self.root = array('b')
+        self.weight = array('d')
+
+# draw a Node's demand from its inflows, in order of pollution index
+# the methodology is presented in Section 5 of our paper
+# returns the total volume drawn and the demand that is still unmet
+# if a breakdown list is given, (inflow index, draw) pairs are added to it
+# order is the inflow indices sorted by pollution index, if already known
+def draw_inflows(demand, vol_inflows, pol_inflows, breakdown=None, order=None):
+    if order is None:
+        order = sorted(range(len(pol_inflows)), key=pol_inflows.__getitem__)
+    D = demand
+    total_draw = 0
+    for k in order:
+        pol = pol_inflows[k]
+        draw = min(vol_inflows[k], D / pol)
+        D = D - draw * pol
+        total_draw += draw
+        if breakdown is not None:
+            breakdown += [(k, draw)]
+    return total_draw, D
 
 class Graph(object):
     # a Graph represents a river basin network
@@ -77,12 +196,39 @@ class Graph(object):
     def __init__(self):
         self.nodes = []  # list of all node objects
         self.edges = {}  # dictionary of [(Edge, dst_name)] indexed by src_name
-                         # TODO: add a weight for the water distribution?
+                         # outflows are split by Edge.weight
+
+        # indexes kept up to date by add_node and add_edge
+        # these let us find things without scanning every node or edge
+        self.node_index = {}   # Node indexed by name
+        self.edge_ends = {}    # (src_name, dst_name) indexed by edge name
+        self.inflows = {}      # list of inflow Edges indexed by dst_name
+
+        self.order = None      # cached topological order of the Nodes
+        self.plan = None       # cached compiled.CompiledGraph, see compile
+        self.solved = {}       # (net outflow, unmet demand) indexed by name
+        self.dirty = set()     # names of Nodes changed since the last solve
+        self.trace = None      # an instrument.SolveTrace, if one is attached
+
+        # water-quality mode: if set, the pollution index of every non-root
+        #   reach is the flow-weighted mix of what is left of its source's
+        #   inflows, rather than a fixed input
+        self.mixing = False
+        # input pollution indices of the reaches mixing has overwritten, by
+        #   name; put back when mixing is turned off
+        self.base_pollution = {}
+        # (pollution indices, inflow indices in drawing order) of each Node,
+        #   by name; see draw_order
+        self.draw_orders = {}
 
     # add a Node object to this Graph
     def add_node(self, node):
         self.nodes += [node]
         self.edges[node.name] = []
+        self.node_index[node.name] = node
+        self.inflows.setdefault(node.name, [])
+        self.order = None
+        self.plan = None
 
     def add_nodes_from_list(self, node_list):
         for node in node_list:
@@ -92,6 +238,10 @@ class Graph(object):
     def add_edge(self, edge, src, dst):
         src_name, dst_name = src.name, dst.name
         self.edges[src_name] += [(edge, dst_name)]
+        self.edge_ends[edge.name] = (src_name, dst_name)
+        self.inflows.setdefault(dst_name, []).append(edge)
+        self.order = None
+        self.plan = None
 
     def add_edges_from_list(self, edge_list):
         for edge, src, dst in edge_list:
@@ -99,23 +249,22 @@ class Graph(object):
 
     # find a node object by name
     def get_node(self, name):
-        for node in self.nodes:
-            if node.name == name:
-                return node
+        return self.node_index.get(name)
+
+    # find the source Node of an Edge, or None if it is not in this Graph
+    def get_source(self, edge):
+        ends = self.edge_ends.get(edge.name)
+        if ends is None:
+            return None
+        return self.node_index[ends[0]]
 
     # find a Node's parent Nodes
     def get_parents(self, node):
-        parents = []
-        for key, val in self.edges.items():
-            _, dst_name = val
-            if dst_name == node.name:
-                parents += self.get_node(key)
-        return parents
+        return [self.get_source(e) for e in self.inflows[node.name]]
 
     # find a Node's child Nodes
     def get_children(self, node):
-        children_names = [dst_name for _, dst_name in self.edges[node.name]]
-        return [self.get_node(name for name in children_names)]
+        return [self.get_node(dst_name) for _, dst_name in self.edges[node.name]]
 
     # set all reaches with nonnegative flows as root flows
     # if false, unset all reaches as root flows
@@ -124,6 +273,8 @@ class Graph(object):
             for reach, _ in val:
                 if reach.flow > 0:
                     reach.root = to
+        self.order = None
+        self.plan = None
 
     # apply a constant demand offset to each Node in this Graph
     # this can be used to, for instance, simulate drawing from an aquifer
@@ -136,6 +287,7 @@ class Graph(object):
                 node.demand += (node.demand / net_demand) * offset
             else:
                 node.demand += offset
+        self.solved = {}
 
     # apply a demand offset for each node per irrigated area
     # this can be used to, for instance, simulate precipitation
@@ -148,6 +300,72 @@ class Graph(object):
             # print('  additional offset is %f' % (node.area * offset_per_area))
             node.demand += node.area * offset_per_area
             # print('  new demand is %f' % node.demand)
+        self.solved = {}
+
+    # change a Node's demand, marking it for re-solving
+    def set_demand(self, node, demand):
+        node.demand = demand
+        self.dirty.add(node.name)
+
+    # change an Edge's pollution index, marking its destination for re-solving
+    # in water-quality mode, a mixed reach keeps the new index as its input,
+    #   to be put back when mixing is turned off
+    def set_pollution(self, edge, pollution):
+        edge.pollution = pollution
+        if edge.name in self.base_pollution:
+            self.base_pollution[edge.name] = pollution
+        self.dirty.add(self.edge_ends[edge.name][1])
+
+    # turn water-quality mode on or off; see self.mixing
+    # turning it off puts back the input pollution indices of mixed reaches
+    # everything is re-solved on the next solve or resolve
+    def set_mixing(self, mixing=True):
+        if not mixing:
+            for val in self.edges.values():
+                for edge, _ in val:
+                    if edge.name in self.base_pollution:
+                        edge.pollution = self.base_pollution[edge.name]
+            self.base_pollution = {}
+        self.mixing = mixing
+        self.solved = {}
+
+    # a Node's inflow indices in drawing order, given their pollution indices
+    # the order is cached along with the indices it was sorted by, and only
+    #   sorted again when they differ, so pollution indices set directly on
+    #   an Edge are picked up too; comparing the lists is cheap
+    def draw_order(self, name, pol_inflows):
+        cached = self.draw_orders.get(name)
+        if cached is not None and cached[0] == pol_inflows:
+            return cached[1]
+        order = sorted(range(len(pol_inflows)), key=pol_inflows.__getitem__)
+        self.draw_orders[name] = (pol_inflows, order)
+        return order
+
+    # in water-quality mode, set the pollution index of a Node's non-root
+    # outflows to the mix of what is left of its inflows after its draws
+    # a Node that is drawn dry passes on the mix of its inflows instead, so
+    #   the result does not depend on what was solved before
+    def mix(self, outflows, vol_inflows, pol_inflows, breakdown):
+        left = list(vol_inflows)
+        for k, draw in breakdown:
+            left[k] -= draw
+        total = sum(left)
+        if total <= 0:
+            left = vol_inflows
+            total = sum(left)
+            if total <= 0:
+                return
+        mixed = sum(v * p for v, p in zip(left, pol_inflows)) / total
+        for o in outflows:
+            if not o.root:
+                if o.name not in self.base_pollution:
+                    self.base_pollution[o.name] = o.pollution
+                o.pollution = mixed
+
+    # change a root Edge's flow, marking its destination for re-solving
+    def set_root_flow(self, edge, flow):
+        edge.flow = flow
+        self.dirty.add(self.edge_ends[edge.name][1])
 
     # solve for the flow through a given Edge
     # if the flow is unknown, we recursively back-trace, solving as we go
@@ -157,71 +375,368 @@ class Graph(object):
         # this may cause an infinite loop if demand exceeds supply
         # we will avoid that with a check later
         if edge.flow > 0:
+            if self.trace is not None:
+                self.trace.hit(edge.name)
             return edge.flow
 
         # find this edge's source Node
-        source = None
-        for key, val in self.edges.items():
-            for e, _ in val:
-                if e.name == edge.name:
-                    source = self.get_node(key)
-                    break
+        source = self.get_source(edge)
         if source is None:
             raise Exception('Edge not found in graph')
+        if self.trace is not None:
+            self.trace.miss(edge.name)
+            self.trace.begin(source.name)
 
         # find all outflow Edges of that source Node
         # this should include the original argument 'edge'
         outflows = [e for e, _ in self.edges[source.name]]
 
         # find all inflow Edges of that source Node
-        inflows = []
-        for key, val in self.edges.items():
-            for e, d in val:
-                if d == source.name:
-                    inflows += [e]
+        inflows = self.inflows[source.name]
 
         # recursively get all volume inflows of this node
-        vol_inflows = [self.get_flow(f) for f in inflows]
+        # a shortfall upstream records this reach in its chain on the way out
+        try:
+            vol_inflows = [self.get_flow(f) for f in inflows]
+        except SupplyError as err:
+            err.chain += [edge.name]
+            if self.trace is not None:
+                self.trace.abort(source.name)
+            raise
 
         # pollution indices of all inflows
         pol_inflows = [f.pollution for f in inflows]
 
-        # sort inflow data by pollution index and compute net outflow
-        # the methodology is presented in Section 5 of our paper
-        inflow_data = sorted(zip(vol_inflows, pol_inflows), key=lambda x: x[1])
-        D = source.demand
-        total_draw = 0
-        for vol, pol in inflow_data:
-            draw = min(vol, D / pol)
-            D = D - draw * pol
-            total_draw += draw
+        # draw the demand from the inflows and compute net outflow
+        breakdown = [] if self.trace is not None or self.mixing else None
+        total_draw, D = draw_inflows(source.demand, vol_inflows, pol_inflows,
+                                     breakdown,
+                                     self.draw_order(source.name, pol_inflows))
         net_outflow = sum(vol_inflows) - total_draw
+        if self.trace is not None:
+            self.trace.end(source.name, inflows, vol_inflows, breakdown)
 
         # compare against 1 because float comparisons against 0 are sketch
         if net_outflow < 0 or D > 1:
-            print('we are stuck on %s, parent node %s' % (edge.name,
-                                                          source.name))
-            print('original demand is %d' % source.demand)
-            print('excess demand is D = %d' % D)
-            print('inflows are: %s' % ' '.join([str(f.flow) for f in inflows]))
-            raise Exception('Water supply could not be solved at node [%s]' \
-                                                                  % source.name)
-
-        # since we do not have historical data, divide the outflows evenly
+            err = self.supply_error(source, D, inflows, vol_inflows)
+            err.chain += [edge.name]
+            raise err
+
+        # without historical data, the outflows are split evenly unless
+        #   they have been given routing weights
+        total_weight = sum(o.weight for o in outflows)
         for o in outflows:
-            o.flow = net_outflow / len(outflows)
+            o.flow = net_outflow * o.weight / total_weight
+        if self.mixing:
+            self.mix(outflows, vol_inflows, pol_inflows, breakdown)
         return edge.flow
 
+    # build the SupplyError for a Node that ran dry, and trace it if tracing
+    def supply_error(self, node, D, inflows, vol_inflows):
+        err = SupplyError(node.name, node.demand, D,
+                          [(f.name, v, f.pollution)
+                           for f, v in zip(inflows, vol_inflows)])
+        if self.trace is not None:
+            self.trace.fail(err)
+        return err
+
+    # sort the Nodes so that every Node comes after all of its parents
+    # root reaches are given, so they do not count as dependencies
+    # the order is cached until the topology or the root reaches change
+    def topological_order(self):
+        if self.order is not None:
+            return self.order
+
+        order = self.partial_order()
+        if len(order) < len(self.nodes):
+            raise Exception('Graph contains a cycle of non-root reaches')
+        self.order = order
+        return order
+
+    # Kahn's algorithm, as far as it gets: every Node that can be placed
+    # in dependency order, in that order; Nodes left out are on or below a
+    # cycle of non-root reaches
+    def partial_order(self):
+        pending = {}
+        for node in self.nodes:
+            pending[node.name] = sum(1 for e in self.inflows[node.name]
+                                     if not e.root)
+        ready = deque(node for node in self.nodes if pending[node.name] == 0)
+        order = []
+        while ready:
+            node = ready.popleft()
+            order += [node]
+            for reach, dst_name in self.edges[node.name]:
+                if reach.root:
+                    continue
+                pending[dst_name] -= 1
+                if pending[dst_name] == 0:
+                    ready.append(self.node_index[dst_name])
+        return order
+
+    # check the Graph's wiring once, and build its execution plan
+    # raises a GraphError listing every problem found:
+    #   reaches that share a name, or run to a Node not in the Graph
+    #   an outlet reach that is not in the Graph
+    #   cycles of non-root reaches
+    #   Nodes that no root reach feeds, not counting sources like EXTERN
+    #     whose outflows are all root reaches
+    #   root reaches with no path downstream to the outlet
+    # returns a compiled.CompiledGraph, which later solves can reuse; it is
+    #   cached until the topology or the root reaches change, and only its
+    #   parameters are re-read on later calls
+    def compile(self, outlet='OUT'):
+        from compiled import CompiledGraph
+
+        if self.plan is not None and self.plan.outlet == outlet:
+            self.plan.refresh(self)
+            return self.plan
+
+        problems = []
+        edges = [(e, src, dst) for src, val in self.edges.items()
+                               for e, dst in val]
+        names = set()
+        for e, src, dst in edges:
+            if e.name in names:
+                problems += ['reach [%s] is in the graph more than once'
+                             % e.name]
+            names.add(e.name)
+            if dst not in self.node_index:
+                problems += ['reach [%s] runs to unknown node [%s]'
+                             % (e.name, dst)]
+        if outlet not in self.edge_ends:
+            problems += ['outlet reach [%s] is not in the graph' % outlet]
+        if problems:
+            raise GraphError(problems)
+
+        order = self.order or self.partial_order()
+        if len(order) < len(self.nodes):
+            placed = set(node.name for node in order)
+            # trim the ones that are only below a cycle
+            left = set(node.name for node in self.nodes
+                       if node.name not in placed)
+            trimmed = True
+            while trimmed:
+                below = [name for name in left
+                         if not any(dst in left for reach, dst
+                                    in self.edges[name] if not reach.root)]
+                left.difference_update(below)
+                trimmed = bool(below)
+            problems += ['cycle of non-root reaches through nodes [%s]'
+                         % ', '.join(node.name for node in self.nodes
+                                     if node.name in left)]
+            raise GraphError(problems)
+        self.order = order
+
+        # everything downstream of the root reaches, through non-root ones
+        fed = set()
+        pending = [dst for e, _, dst in edges if e.root]
+        while pending:
+            name = pending.pop()
+            if name not in fed:
+                fed.add(name)
+                pending += [dst for reach, dst in self.edges[name]
+                            if not reach.root]
+        for node in self.nodes:
+            outflows = self.edges[node.name]
+            if node.name not in fed and not (outflows and
+                                             all(e.root for e, _ in outflows)):
+                problems += ['node [%s] is not fed by any root reach'
+                             % node.name]
+
+        # everything upstream of the outlet, through non-root reaches
+        drains = set()
+        pending = [self.edge_ends[outlet][0]]
+        while pending:
+            name = pending.pop()
+            if name not in drains:
+                drains.add(name)
+                pending += [self.edge_ends[e.name][0]
+                            for e in self.inflows[name] if not e.root]
+        for e, _, dst in edges:
+            if e.root and dst not in drains:
+                problems += ['root reach [%s] has no path to outlet [%s]'
+                             % (e.name, outlet)]
+        if problems:
+            raise GraphError(problems)
+
+        self.plan = CompiledGraph(self)
+        self.plan.outlet = outlet
+        return self.plan
+
+    # split the Graph into sub-basins: runs of Nodes between confluences and
+    # forks, each of which can be solved on its own once its inflows from
+    # other sub-basins are known
+    # a Node starts a new sub-basin unless its only non-root inflow comes
+    #   from a Node with no other non-root outflow
+    # returns a list of sub-basins, each a list of Nodes in flow order, with
+    #   every sub-basin after all of the ones it takes water from
+    def sub_basins(self):
+        basin = {}    # index of each Node's sub-basin, by name
+        basins = []
+        for node in self.topological_order():
+            parents = [self.edge_ends[e.name][0]
+                       for e in self.inflows[node.name] if not e.root]
+            if len(parents) == 1 and sum(1 for e, _ in self.edges[parents[0]]
+                                         if not e.root) == 1:
+                k = basin[parents[0]]
+                basins[k] += [node]
+            else:
+                k = len(basins)
+                basins += [[node]]
+            basin[node.name] = k
+        return basins
+
+    # solve for the flows through every Edge in a single pass
+    # unlike get_flow, this visits each Node exactly once, in dependency
+    # order, and does not recurse, so it works for basins of any depth
+    # root reaches are taken as given; returns the flows indexed by edge name
+    # if not strict, a Node that runs dry takes what it can instead of
+    #   raising a SupplyError, and its unmet demand is left in deficits()
+    def solve(self, strict=True):
+        self.solved = {}
+        self.dirty = set()
+        for node in self.topological_order():
+            self.solve_node(node, strict)
+        return self.get_flows()
+
+    # re-solve only what changed since the last solve
+    # Nodes changed through set_demand, set_pollution or set_root_flow, and
+    # everything downstream of them, are recomputed in dependency order;
+    # upstream results are reused as they are
+    # falls back to a full solve if nothing has been solved yet
+    def resolve(self, strict=True):
+        if not self.solved:
+            return self.solve(strict)
+
+        # collect the downstream cone of the changed Nodes
+        cone = set()
+        pending = list(self.dirty)
+        while pending:
+            name = pending.pop()
+            if name in cone:
+                continue
+            cone.add(name)
+            pending += [dst for reach, dst in self.edges[name]
+                        if not reach.root]
+
+        for node in self.topological_order():
+            if node.name in cone:
+                self.solve_node(node, strict)
+            elif self.trace is not None and node.name in self.solved:
+                self.trace.hit(node.name)
+        self.dirty = set()
+        return self.get_flows()
+
+    # current flows through every Edge, indexed by edge name
+    def get_flows(self):
+        return dict((e.name, e.flow) for val in self.edges.values()
+                                     for e, _ in val)
+
+    # unmet demand of every Node that ran dry in the last solve, by name
+    # only non-strict solves can leave any
+    def deficits(self):
+        return dict((name, D) for name, (_, D) in self.solved.items() if D > 1)
+
+    # solve a single Node, assuming all of its inflows are already known
+    # the result is cached in self.solved
+    def solve_node(self, node, strict=True):
+        outflows = [e for e, _ in self.edges[node.name]]
+        if all(e.root for e in outflows):
+            return
+
+        if self.trace is not None:
+            self.trace.miss(node.name)
+            self.trace.begin(node.name)
+
+        inflows = self.inflows[node.name]
+        vol_inflows = [f.flow for f in inflows]
+        pol_inflows = [f.pollution for f in inflows]
+        breakdown = [] if self.trace is not None or self.mixing else None
+        total_draw, D = draw_inflows(node.demand, vol_inflows, pol_inflows,
+                                     breakdown,
+                                     self.draw_order(node.name, pol_inflows))
+        net_outflow = sum(vol_inflows) - total_draw
+        if self.trace is not None:
+            self.trace.end(node.name, inflows, vol_inflows, breakdown)
+
+        # compare against 1 because float comparisons against 0 are sketch
+        if strict and (net_outflow < 0 or D > 1):
+            err = self.supply_error(node, D, inflows, vol_inflows)
+            err.chain += [outflows[0].name]
+            raise err
+
+        # draws never exceed the inflows, so this only guards against
+        #   negative inflows from upstream
+        net_outflow = max(net_outflow, 0)
+
+        # without historical data, the outflows are split evenly unless
+        #   they have been given routing weights
+        total_weight = sum(o.weight for o in outflows)
+        for o in outflows:
+            if not o.root:
+                o.flow = net_outflow * o.weight / total_weight
+        if self.mixing:
+            self.mix(outflows, vol_inflows, pol_inflows, breakdown)
+        self.solved[node.name] = (net_outflow, D)
+
+    # save node demands, areas and populations, and edge flows, pollution
+    # indices, root flags and weights, so they can be put back with restore
+    # passing an old Snapshot reuses its arrays instead of allocating
+    def snapshot(self, into=None):
+        snap = into if into is not None else Snapshot()
+        for name in Snapshot.__slots__:
+            del getattr(snap, name)[:]
+        for node in self.nodes:
+            snap.demand.append(node.demand)
+            snap.area.append(node.area)
+            snap.population.append(node.population)
+        for val in self.edges.values():
+            for edge, _ in val:
+                snap.flow.append(edge.flow)
+                snap.pollution.append(edge.pollution)
+                snap.root.append(edge.root)
+                snap.weight.append(edge.weight)
+        return snap
+
+    # put back the state saved by snapshot, in place
+    # the topology must not have changed since the snapshot was taken
+    def restore(self, snap):
+        for i, node in enumerate(self.nodes):
+            node.demand = snap.demand[i]
+            node.area = snap.area[i]
+            node.population = snap.population[i]
+        i = 0
+        rerooted = False
+        for val in self.edges.values():
+            for edge, _ in val:
+                edge.flow = snap.flow[i]
+                edge.pollution = snap.pollution[i]
+                if edge.root != bool(snap.root[i]):
+                    edge.root = bool(snap.root[i])
+                    rerooted = True
+                edge.weight = snap.weight[i]
+                i += 1
+
+        # the order and the plan only depend on the topology and the root
+        # reaches; the plan's parameters are re-read by compile anyway
+        if rerooted:
+            self.order = None
+            self.plan = None
+        self.solved = {}
+        self.dirty = set()
+
     # clear all the flows after solving, except for root flows
     # this resets all Edge flows to -1
     # this should be doable from the outside, since Edges are just references,
     # but it's more convenient to do here
     def clear_all_flows(self, skip=[]):
+        skip_names = set(e.name for e in skip)
         for _, val in self.edges.items():
             for edge, _ in val:
-                if edge.name not in map(lambda e: e.name, skip) \
-                         and not edge.root:
+                if edge.name not in skip_names and not edge.root:
                     edge.flow = -1
+        self.solved = {}
 
     # pretty-print a Node
     def report_node(self, node):
@@ -230,19 +745,14 @@ class Graph(object):
             if node.population < 100:
                 node_type = 'Irrigation District'
             else:
-                node.type = 'Combined'
+                node_type = 'Combined'
         return '%s: %s [%d MCM/yr]' % (node.name, node_type, node.demand)
 
     # pretty print an Edge
-    def report_edge(self, edge):
-        # find source and destination names
-        src = ''
-        dst = ''
-        for key, val in self.edges.items():
-            for e, d in val:
-                if e.name == edge.name:
-                    src = key
-                    dst = d
+    # the source and destination names are looked up if not given
+    def report_edge(self, edge, src=None, dst=None):
+        if src is None or dst is None:
+            src, dst = self.edge_ends.get(edge.name, ('', ''))
         return '%s [%.3f]: %f MCM/yr ( %s => %s )' % (edge.name,
                                                       edge.pollution,
                                                       edge.flow,
@@ -253,12 +763,19 @@ class Graph(object):
             for e, _ in val:
                 print('%s, %f' % (e.name, e.flow))
 
+    # the lines of the report, one at a time, in a single pass
+    def iter_report(self):
+        for node in self.nodes:
+            yield self.report_node(node)
+            for reach, dst_name in self.edges[node.name]:
+                yield '  ' + self.report_edge(reach, node.name, dst_name)
+
+    # write the report straight to an open file, line by line
+    def write_report(self, f):
+        for line in self.iter_report():
+            f.write(line + '\n')
+
     # pretty-print a nice report
     def report(self):
-        report = []
-        for node in self.nodes:
-            report += [self.report_node(node)]
-            for reach, _ in self.edges[node.name]:
-                report += ['  ' + self.report_edge(reach)]
-        return '\n'.join(report)
+        return '\n'.join(self.iter_report())
 
@@ -0,0 +1,137 @@
+# searching for the best allocation of water-saving policies to districts
+# generalizes agriculture.py, which tries a few hand-picked groups
+
+from array import array
+
+from compiled import CompiledGraph
+from network import Node
+
+class PolicyOptimizer(object):
+    # a PolicyOptimizer allocates water-saving coefficients to districts
+    # under a budget, to get the most water through a target reach
+    # each district can be moved through a ladder of (a, b) coefficients,
+    #   as passed to Node.compute_demand: a scales crop demand, b urban
+    # the search is greedy: every round, each district's next step up its
+    #   ladder is evaluated in one batched solve, and the step with the
+    #   best gain per unit cost is taken, until the budget runs out
+
+    # constructor takes:
+    #   a built network.Graph, with its root reaches already set
+    #   levels: the ladder of (a, b) coefficients, from mildest to strongest
+    #   target: name of the reach whose flow is maximized
+    #   cost: function (node, a, b) giving the cost of a district's policy;
+    #     by default, the water it saves, in MCM / year
+    #   objective: function (flow array, deficit array) giving the score to
+    #     maximize, or None for an unacceptable allocation; by default, the
+    #     flow through the target reach, with allocations that run any node
+    #     dry unacceptable, or, if the base case already runs some node dry,
+    #     the total unmet demand, negated so that less shortfall scores higher
+    def __init__(self, graph, levels, target='OUT', cost=None, objective=None):
+        self.compiled = CompiledGraph(graph)
+        self.levels = [(1, 1)] + list(levels)
+        self.target = target
+        self.cost = cost or self.water_saved
+        if objective is None:
+            _, deficit = self.compiled.solve(strict=False)
+            if any(deficit):
+                objective = self.shortfall
+            else:
+                target_id = self.compiled.edge_id[target]
+                objective = lambda flow, deficit: \
+                    None if any(deficit) else flow[target_id]
+        self.objective = objective
+
+        # only districts upstream of the target can change its flow
+        upstream = self.compiled.upstream(target)
+        self.nodes = [graph.get_node(name) for name in self.compiled.node_names]
+        self.districts = [i for i in upstream if self.nodes[i].demand != 0]
+
+        self.cache = {}        # scores indexed by allocation
+        self.evaluations = 0   # solves actually run
+
+    # default cost: the water a policy saves, in MCM / year
+    @staticmethod
+    def water_saved(node, a, b):
+        urban = node.population * Node.scarcity_threshold / 1000000
+        return (1 - a) * node.avg_crop_need * node.area * 2 + (1 - b) * urban
+
+    # objective for infeasible basins: the total unmet demand, negated
+    @staticmethod
+    def shortfall(flow, deficit):
+        return -sum(deficit)
+
+    # node demands under an allocation, a tuple of ladder positions by node
+    # the offsets already in each demand are kept, like agriculture.py does
+    def demands(self, allocation):
+        demand = array('d', self.compiled.demand)
+        for i, level in enumerate(allocation):
+            if level:
+                a, b = self.levels[level]
+                demand[i] -= self.water_saved(self.nodes[i], a, b)
+        return demand
+
+    # total cost of an allocation
+    def spent(self, allocation):
+        return sum(self.cost(self.nodes[i], *self.levels[level])
+                   for i, level in enumerate(allocation) if level)
+
+    # score a list of allocations, using and filling the cache
+    # allocations the objective finds unacceptable score None
+    def score(self, allocations):
+        todo = [x for x in set(allocations) if x not in self.cache]
+        if todo:
+            rows = [self.demands(x) for x in todo]
+            self.evaluations += len(todo)
+            flows, deficits = self.compiled.solve_batch(demand=rows,
+                                                        strict=False)
+            for x, flow, deficit in zip(todo, flows, deficits):
+                self.cache[x] = self.objective(flow, deficit)
+        return [self.cache[x] for x in allocations]
+
+    # run the search
+    # takes the budget, in the units of the cost function
+    # returns (coefficients by district name, score, amount spent)
+    def optimize(self, budget):
+        allocation = tuple([0] * len(self.nodes))
+        best = self.score([allocation])[0]
+        spent = 0
+
+        while True:
+            moves = []
+            for i in self.districts:
+                if allocation[i] + 1 >= len(self.levels):
+                    continue
+                step = list(allocation)
+                step[i] += 1
+                step = tuple(step)
+                cost = self.spent(step) - spent
+                if cost > 0 and spent + cost <= budget:
+                    moves += [(step, cost)]
+            if not moves:
+                break
+
+            scores = self.score([step for step, _ in moves])
+            ranked = [((score - best) / cost, step, cost, score)
+                      for (step, cost), score in zip(moves, scores)
+                      if score is not None and best is not None
+                      and score > best]
+            if not ranked:
+                break
+            _, allocation, cost, best = max(ranked, key=lambda x: x[0])
+            spent += cost
+
+        policy = dict((self.nodes[i].name, self.levels[level])
+                      for i, level in enumerate(allocation) if level)
+        return policy, best, spent
+
+if __name__ == '__main__':
+    from model import get_model
+
+    graph, _, _ = get_model('kharif')
+    optimizer = PolicyOptimizer(graph, [(0.9, 1), (0.85, 1), (0.776, 1)])
+    for budget in [5000, 20000, 50000]:
+        policy, outflow, spent = optimizer.optimize(budget)
+        print('budget %d: outflow %f, spent %f' % (budget, outflow, spent))
+        for name, (a, b) in sorted(policy.items()):
+            print('  %s: a=%.3f, b=%.3f' % (name, a, b))
+    print('%d allocations evaluated' % optimizer.evaluations)
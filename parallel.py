@@ -0,0 +1,200 @@
+# solving a single basin across cores, one sub-basin at a time
+# Graph.sub_basins splits the basin at confluences and forks; a sub-basin
+# is handed to a worker as soon as every sub-basin feeding it is solved, so
+# independent tributaries are solved at the same time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+                               wait, FIRST_COMPLETED
+from array import array
+
+from compiled import CompiledGraph
+
+# the CompiledGraph of a worker process, sent once when the pool starts
+worker_compiled = None
+
+def init_worker(compiled):
+    global worker_compiled
+    worker_compiled = compiled
+
+# solve one sub-basin
+# takes the CompiledGraph, the sub-basin's node ids in order, and its
+#   external inputs: (edge id, flow, pollution) for every reach flowing
+#   into it from outside, demands of its nodes, and pollution indices of
+#   its internal reaches, as lists of (id, value)
+# returns (flows of the reaches out of its nodes, deficits), as lists of
+#   (id, value); deficits is None when strict
+# this has to live at module level so the pool can pickle it
+def solve_part(compiled, nodes, inputs, demand, pollution, strict):
+    compiled = compiled or worker_compiled
+    flow = dict((e, v) for e, v, _ in inputs)
+    pol = dict((e, p) for e, _, p in inputs)
+    pol.update(pollution)
+    deficit = None if strict else {}
+    compiled.solve_nodes(nodes, dict(demand), pol, flow, deficit)
+
+    outflows = [e for i in nodes
+                for e in compiled.out_idx[compiled.out_ptr[i]:
+                                          compiled.out_ptr[i + 1]]
+                if not compiled.root[e]]
+    return [(e, flow[e]) for e in outflows], \
+        None if strict else list(deficit.items())
+
+class ParallelSolver(object):
+    # a ParallelSolver solves one basin with its sub-basins spread across a
+    # pool of workers
+    # sub-basins with fewer than [inline] nodes are solved in this process,
+    #   since shipping them to a worker would cost more than solving them
+    # processes give real parallelism; threads only help when the solver
+    #   kernel can run without the interpreter lock
+
+    # constructor takes:
+    #   a built network.Graph, with its root reaches already set
+    #   workers: pool size, defaults to one per core
+    #   processes: whether to use a process pool, rather than threads
+    #   inline: smallest sub-basin, in nodes, worth sending to a worker
+    def __init__(self, graph, workers=None, processes=True, inline=64):
+        self.compiled = c = CompiledGraph(graph)
+        self.inline = inline
+        active = set(c.active)
+
+        # sub-basins as compiled node ids, leaving out nodes with nothing
+        # to solve
+        self.parts = []
+        for basin in graph.sub_basins():
+            nodes = [c.node_id[node.name] for node in basin]
+            nodes = array('l', [i for i in nodes if i in active])
+            if nodes:
+                self.parts += [nodes]
+
+        # the reaches each sub-basin takes from outside, and the sub-basins
+        # it has to wait for
+        part_of = {}
+        for k, nodes in enumerate(self.parts):
+            for i in nodes:
+                part_of[i] = k
+        self.inputs, self.internal, self.upstream = [], [], []
+        for k, nodes in enumerate(self.parts):
+            inputs, internal, upstream = [], [], set()
+            for i in nodes:
+                for e in c.in_idx[c.in_ptr[i]:c.in_ptr[i + 1]]:
+                    src = part_of.get(c.edge_src[e])
+                    if c.root[e] or src != k:
+                        inputs += [e]
+                        if not c.root[e] and src is not None:
+                            upstream.add(src)
+                    else:
+                        internal += [e]
+            self.inputs += [array('l', inputs)]
+            self.internal += [array('l', internal)]
+            self.upstream += [upstream]
+        self.downstream = [[] for _ in self.parts]
+        for k, upstream in enumerate(self.upstream):
+            for j in upstream:
+                self.downstream[j] += [k]
+
+        if processes:
+            self.pool = ProcessPoolExecutor(workers, initializer=init_worker,
+                                            initargs=(c,))
+        else:
+            self.pool = ThreadPoolExecutor(workers)
+        self.remote = None if processes else c
+
+    # solve every reach, like CompiledGraph.solve, and with the same
+    # arguments and results
+    def solve(self, demand=None, pollution=None, flow=None, strict=True):
+        c = self.compiled
+        demand = c.demand if demand is None else demand
+        pollution = c.pollution if pollution is None else pollution
+        flow = array('d', c.flow if flow is None else flow)
+        deficit = array('d', [0.0] * len(c.node_names))
+
+        def args(k):
+            nodes = self.parts[k]
+            return (nodes,
+                    [(e, flow[e], pollution[e]) for e in self.inputs[k]],
+                    [(i, demand[i]) for i in nodes],
+                    [(e, pollution[e]) for e in self.internal[k]],
+                    strict)
+
+        waiting = [len(upstream) for upstream in self.upstream]
+        ready = [k for k, n in enumerate(waiting) if n == 0]
+        running = {}
+        try:
+            while ready or running:
+                # solve small sub-basins here, and send the rest off
+                done = []
+                for k in ready:
+                    if len(self.parts[k]) < self.inline:
+                        done += [(k, solve_part(c, *args(k)))]
+                    else:
+                        future = self.pool.submit(solve_part, self.remote,
+                                                  *args(k))
+                        running[future] = k
+                ready = []
+                if not done:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    done = [(running.pop(f), f.result()) for f in finished]
+
+                # merge results into the flows, and free up sub-basins
+                # waiting on these ones
+                for k, (outflows, deficits) in done:
+                    for e, v in outflows:
+                        flow[e] = v
+                    for i, D in deficits or []:
+                        deficit[i] = D
+                    for j in self.downstream[k]:
+                        waiting[j] -= 1
+                        if waiting[j] == 0:
+                            ready += [j]
+        finally:
+            for future in running:
+                future.cancel()
+
+        if not strict:
+            return flow, deficit
+        return flow
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    import time
+
+    from network import Node, Edge, Graph
+
+    # a synthetic basin of long, independent tributaries meeting at one
+    # confluence
+    tributaries, length = 8, 20000
+    graph = Graph()
+    extern = Node('EXTERN', 'none', 0, 0)
+    mouth = Node('MOUTH', 'none', 0, 0)
+    graph.add_nodes_from_list([extern, mouth])
+    for t in range(tributaries):
+        upper = extern
+        for i in range(length):
+            node = Node('T%d-%d' % (t, i), 'wheat', 1, 100)
+            graph.add_node(node)
+            flow = 1e6 if upper is extern else -1
+            graph.add_edge(Edge('T%d-%d' % (t, i), flow, 0.8), upper, node)
+            upper = node
+        graph.add_edge(Edge('T%d-out' % t, -1, 0.8), upper, mouth)
+    graph.add_edge(Edge('OUT', -1, 1), mouth, extern)
+    graph.set_root()
+
+    compiled = CompiledGraph(graph)
+    start = time.perf_counter()
+    expected = compiled.solve()
+    print('serial: %.3fs' % (time.perf_counter() - start))
+    with ParallelSolver(graph) as solver:
+        solver.solve()    # warm up the pool
+        start = time.perf_counter()
+        result = solver.solve()
+        print('parallel, %d sub-basins: %.3fs'
+              % (len(solver.parts), time.perf_counter() - start))
+    print('same flows: %s' % (result == expected))
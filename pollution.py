@@ -1,7 +1,7 @@
 # pollution analysis
 
-from model import KharifGangesModel, RabiGangesModel, \
-                  KharifRivers, RabiRivers, KharifCrops, RabiCrops
+from model import KharifGangesModel, KharifRivers
+from compiled import CompiledGraph
 
 def get_flows(rivers):
     return [(reach.name, reach.flow) for _, reach in vars(rivers).items()]
@@ -10,17 +10,18 @@ def pollution_analysis(model, rivers, delta=1.1):
     # adjust each pollution index by [delta] and see effect on outflows
 
     # base flow for comparison
-    model.get_flow(rivers.OUT)
+    model.solve()
     flows = {'base': get_flows(rivers)}
 
     # adjust each pollution by indicated delta
+    # only the reaches downstream of the change need to be re-solved
     for _, reach in vars(rivers).items():
-        model.clear_all_flows(skip=[rivers.Y1, rivers.Ga0, rivers.Gh0])
         old = reach.pollution
-        reach.pollution = min(reach.pollution * delta, 1)
-        model.get_flow(rivers.OUT)
+        model.set_pollution(reach, min(reach.pollution * delta, 1))
+        model.resolve()
         flows[reach.name] = get_flows(rivers)
-        reach.pollution = old
+        model.set_pollution(reach, old)
+    model.resolve()
 
     # compute the pct flow change in a given reach
     def find_change(data):
@@ -37,6 +38,18 @@ def pollution_analysis(model, rivers, delta=1.1):
         result[key] = (avg_change, max_change)
     return result
 
+# analytic version of pollution_analysis for the outflow
+# one forward and one backward pass give the pct change in outflow for a
+# 1 pct change in each reach's pollution index (the elasticity)
+def pollution_elasticity(model, outlet='OUT'):
+    compiled = CompiledGraph(model)
+    flow, tape = compiled.record()
+    _, d_pollution, _ = compiled.backward((flow, tape), outlet)
+    out = flow[compiled.edge_id[outlet]]
+    return dict((name, d * compiled.pollution[e] / out)
+                for e, (name, d) in enumerate(zip(compiled.edge_names,
+                                                  d_pollution)))
+
 result = pollution_analysis(KharifGangesModel, KharifRivers, delta=1.2)
 for key, val in result.items():
     print('%s: %.5f %.5f (%s)' % (key, val[0]*100, val[1][0]*100, val[1][1]))
@@ -0,0 +1,204 @@
+# linear routing of root inflows through a compiled basin
+# as long as every node draws its demand the same way, each reach's flow is
+# an affine function of the root inflows, so new inflows can be routed by a
+# sparse matrix-vector product instead of a pass over every node
+# this only pays off for a few reaches, like the outlet: each reach's row
+# has an entry for every root inflow upstream of it, so routing the whole
+# network does more work per scenario than CompiledGraph.solve_batch
+
+from array import array
+from operator import mul
+
+# add up sparse affine expressions of the root inflows
+# an expression is (constant, {root edge: coefficient}); terms is a list
+# of (scale, expression), and const is added on top
+def combine(terms, const=0.0):
+    coef = {}
+    for scale, (c, row) in terms:
+        const += scale * c
+        for e, v in row.items():
+            coef[e] = coef.get(e, 0.0) + scale * v
+    return const, coef
+
+# pack a list of expressions into sparse rows of (constant, columns,
+# coefficients), with the columns and coefficients in flat arrays
+def pack(exprs):
+    rows = []
+    for c, row in exprs:
+        cols = sorted(e for e, v in row.items() if v != 0)
+        rows += [(c, array('l', cols), array('d', [row[e] for e in cols]))]
+    return rows
+
+# evaluate one packed row at x
+def dot(row, x):
+    c, cols, vals = row
+    return c + sum(map(mul, vals, map(x.__getitem__, cols)))
+
+class RoutingMatrix(object):
+    # a RoutingMatrix linearizes a CompiledGraph around one set of inputs
+    # the flows are F r + f, where r holds the root inflows, and the draw
+    #   regime of every node (which inflows it drains, and which one it
+    #   stops drawing part way through) holds while the slacks S r + s are
+    #   all nonnegative; F and S are kept as sparse rows
+    # demands and pollution indices are fixed; only root inflows vary
+    # inflows that leave the regime are solved in full instead, and the
+    #   matrix is rebuilt around them
+
+    # constructor takes:
+    #   a CompiledGraph
+    #   demand, pollution, flow: the inputs to linearize around; they
+    #     default to the compiled parameters
+    #   tolerance: how far below zero a slack may be rounded, in MCM / year
+    # raises a SupplyError if some node runs dry at those inputs
+    def __init__(self, compiled, demand=None, pollution=None, flow=None,
+                 tolerance=1e-6):
+        self.compiled = compiled
+        self.demand = compiled.demand if demand is None else demand
+        self.pollution = compiled.pollution if pollution is None else pollution
+        self.tolerance = tolerance
+        self.rebuilds = 0    # times the regime changed
+        self.build(compiled.flow if flow is None else flow)
+
+    # solve at the given inflows, and linearize around the solution
+    # returns the solved flows
+    def build(self, flow):
+        c = self.compiled
+        demand, pollution = self.demand, self.pollution
+        flow = c.solve(demand, pollution, flow)
+
+        exprs = [(0.0, {e: 1.0}) if c.root[e] else None
+                 for e in range(len(c.edge_names))]
+        slacks = []
+        for i in c.active:
+            inflows = c.in_idx[c.in_ptr[i]:c.in_ptr[i + 1]]
+
+            # follow the draw logic of network.draw_inflows, keeping the
+            # demand left both as a number and as an expression
+            left = demand[i]
+            D = (left, {})
+            draws = []
+            for e in sorted(inflows, key=pollution.__getitem__):
+                pol = pollution[e]
+                if flow[e] <= left / pol:
+                    # drained whole: stays so while v <= D / p
+                    slacks += [combine([(1 / pol, D), (-1, exprs[e])])]
+                    draws += [exprs[e]]
+                    D = combine([(1, D), (-pol, exprs[e])])
+                    left -= flow[e] * pol
+                else:
+                    # drawn part way: stays so while v >= D / p, and the
+                    #   demand is met, so later inflows are left alone
+                    slacks += [combine([(1, exprs[e]), (-1 / pol, D)])]
+                    draws += [combine([(1 / pol, D)])]
+                    break
+            else:
+                # every inflow drained; the demand left must stay below 1
+                slacks += [combine([(-1, D)], 1.0)]
+
+            net = combine([(1, exprs[e]) for e in inflows] +
+                          [(-1, draw) for draw in draws])
+            for e in c.out_idx[c.out_ptr[i]:c.out_ptr[i + 1]]:
+                if not c.root[e]:
+                    exprs[e] = combine([(c.weight[e] / c.out_weight[i], net)])
+
+        # slacks that do not depend on the inflows can never go negative
+        self.flows = pack(exprs)
+        self.slacks = [row for row in pack(slacks) if row[1]]
+        return flow
+
+    # whether the flows at these root inflows are in the current regime
+    def in_regime(self, flow):
+        return all(dot(row, flow) >= -self.tolerance for row in self.slacks)
+
+    # route a set of root inflows, like CompiledGraph.solve
+    # flow holds the inflows by edge; only the root entries are read
+    # results agree with a full solve up to rounding
+    # returns a new flow array
+    def route(self, flow):
+        if not self.in_regime(flow):
+            self.rebuilds += 1
+            return self.build(flow)
+        return array('d', [dot(row, flow) for row in self.flows])
+
+    # whether every set of root inflows between lo and hi (by edge) is in
+    # the current regime; each slack is smallest at a corner of that box
+    def box_in_regime(self, lo, hi):
+        for c, cols, vals in self.slacks:
+            low = c + sum(v * (lo[e] if v > 0 else hi[e])
+                          for e, v in zip(cols, vals))
+            if low < -self.tolerance:
+                return False
+        return True
+
+    # route a batch of inflow rows, like CompiledGraph.solve_batch
+    # if the box spanned by the rows is in the regime, the regime is not
+    #   checked row by row; otherwise each row is routed on its own
+    # names: reaches to route; with names given, each result is a list of
+    #   those reaches' flows; without, every reach is routed, which is
+    #   slower than solve_batch, so pass names where possible
+    def route_batch(self, inflow, names=None):
+        if not inflow:
+            return []
+        roots = set(e for _, cols, _ in self.slacks for e in cols)
+        lo = dict((e, min(row[e] for row in inflow)) for e in roots)
+        hi = dict((e, max(row[e] for row in inflow)) for e in roots)
+        if names is None:
+            if not self.box_in_regime(lo, hi):
+                return [self.route(row) for row in inflow]
+            return [array('d', [dot(r, row) for r in self.flows])
+                    for row in inflow]
+
+        ids = [self.compiled.edge_id[name] for name in names]
+        if not self.box_in_regime(lo, hi):
+            return [[flow[e] for e in ids]
+                    for flow in (self.route(row) for row in inflow)]
+        wanted = [self.flows[e] for e in ids]
+        return [[dot(r, row) for r in wanted] for row in inflow]
+
+    # the sensitivity of a reach's flow to each root inflow, by root name
+    def row(self, name):
+        _, cols, vals = self.flows[self.compiled.edge_id[name]]
+        return dict((self.compiled.edge_names[e], v)
+                    for e, v in zip(cols, vals))
+
+    # route a set of root inflows, but only for one reach
+    def flow(self, flow, name):
+        if not self.in_regime(flow):
+            self.rebuilds += 1
+            return self.build(flow)[self.compiled.edge_id[name]]
+        return dot(self.flows[self.compiled.edge_id[name]], flow)
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    from compiled import CompiledGraph
+    from model import get_model
+
+    graph, _, _ = get_model('kharif')
+    compiled = CompiledGraph(graph)
+    routing = RoutingMatrix(compiled)
+    print('OUT = %s' % ' + '.join('%.4f %s' % (v, name) for name, v
+                                  in sorted(routing.row('OUT').items())))
+
+    rng = random.Random(0)
+    rows = []
+    for _ in range(1000):
+        row = array('d', compiled.flow)
+        for e in range(len(row)):
+            if compiled.root[e]:
+                row[e] *= rng.uniform(0.95, 1.05)
+        rows += [row]
+
+    start = time.perf_counter()
+    solved = compiled.solve_batch(inflow=rows)
+    middle = time.perf_counter()
+    routed = routing.route_batch(rows)
+    end = time.perf_counter()
+    error = max(abs(a - b) for x, y in zip(solved, routed)
+                for a, b in zip(x, y))
+    outlet = routing.route_batch(rows, ['OUT'])
+    last = time.perf_counter()
+    print('solve_batch %.4fs, routed %.4fs, outlet only %.4fs'
+          % (middle - start, end - middle, last - end))
+    print('%d rebuilds, max error %g' % (routing.rebuilds, error))
@@ -1,54 +1,72 @@
 # sensitivity analysis
 
+from cache import ResultCache
 from model import KharifGangesModel as kgm, \
                   KharifCrops as kc, \
                   KharifRivers as kr
 
+# each change function takes the model to change as optional arguments,
+# defaulting to the shared Kharif model, so it can also be used by sweep.py
+
 # establish base case
-def change_none(delta):
+def change_none(delta, model=kgm, crops=kc, rivers=kr):
     pass
 
 # change the input flows
-def change_inflows(delta):
-    for _, reach in vars(kr).items():
+def change_inflows(delta, model=kgm, crops=kc, rivers=kr):
+    for _, reach in vars(rivers).items():
         if reach.root:
             reach.flow *= delta
 
 # change the cropping area
-def change_areas(delta):
-    for district in kgm.nodes:
+def change_areas(delta, model=kgm, crops=kc, rivers=kr):
+    for district in model.nodes:
         bonus = district.demand - district.compute_demand()
         district.area *= delta
         district.demand = district.compute_demand() + bonus
 
 # change the pollution indices
-def change_pollution(delta):
-    for _, reach in vars(kr).items():
-        reach.pollution *= delta
+def change_pollution(delta, model=kgm, crops=kc, rivers=kr):
+    for _, reach in vars(rivers).items():
+        model.set_pollution(reach, reach.pollution * delta)
 
 # change populations
-def change_population(delta):
-    for node in kgm.nodes:
+def change_population(delta, model=kgm, crops=kc, rivers=kr):
+    for node in model.nodes:
         bonus = node.demand - node.compute_demand()
         node.population *= delta
         node.demand = node.compute_demand() + bonus
 
 # change rainfall
-def change_rainfall(delta):
-    kgm.apply_area_offset(+kc.rainfall)
-    kc.rainfall *= delta
-    kgm.apply_area_offset(-kc.rainfall)
+def change_rainfall(delta, model=kgm, crops=kc, rivers=kr):
+    model.apply_area_offset(+crops.rainfall)
+    crops.rainfall *= delta
+    model.apply_area_offset(-crops.rainfall)
 
-# run a sensitivity analysis, given a change function
-def sensitivity_analysis(delta_f, level):
-    kgm.get_flow(kr.OUT)
-    old = kr.OUT.flow
+# flow out of the model, solved or read back from a ResultCache
+def outflow(cache=None):
+    if cache is not None:
+        return cache.solve(kgm)[0][kr.OUT.name]
     kgm.clear_all_flows()
-    delta_f(level)
     kgm.get_flow(kr.OUT)
-    print((kr.OUT.flow - old) / old)
+    return kr.OUT.flow
+
+# run a sensitivity analysis, given a change function
+# the model is put back afterwards, so analyses can be run one after another
+# with a ResultCache, solves already done by an earlier run are skipped
+def sensitivity_analysis(delta_f, level, cache=None):
+    original = kgm.snapshot()
+    rainfall = kc.rainfall
+    old = outflow(cache)
+    delta_f(level)
+    new = outflow(cache)
+    print((new - old) / old)
+    kgm.restore(original)
+    kc.rainfall = rainfall
 
 # do analysis by changing this line and running script
 # it isn't pretty, but this project is due tomorrow
-sensitivity_analysis(change_rainfall, 0.95)
+if __name__ == '__main__':
+    with ResultCache('.results.sqlite') as cache:
+        sensitivity_analysis(change_rainfall, 0.95, cache)
 
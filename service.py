@@ -0,0 +1,228 @@
+# asyncio solve service for interactive "what if" queries
+# the season models are built and compiled once; scenarios arriving within
+# a short window of each other are solved together in one solve_batch
+#
+# requests are HTTP POSTs to /solve with a JSON scenario:
+#   {"season": "kharif",
+#    "demand": {node name: offset to its demand, MCM / year},
+#    "flows": {root reach name: flow, MCM / year},
+#    "pollution": {reach name: pollution index}}
+# everything but the season is optional; the response is
+#   {"flows": {reach name: flow}, "deficits": {node name: unmet demand}}
+# scenarios are solved in shortfall-tolerant mode, so one that runs a node
+# dry gets its deficits back instead of failing the rest of its batch
+
+import argparse
+import asyncio
+import json
+import math
+from array import array
+
+from model import get_model
+
+class Batcher(object):
+    # a Batcher collects the scenarios for one season and solves them in
+    # batches: a batch is solved once it is full, or [window] seconds
+    # after its first scenario arrived, whichever comes first
+
+    # constructor takes:
+    #   a CompiledGraph of the season's model, e.g. from Graph.compile
+    #   window: how long to wait for more scenarios, in seconds
+    #   max_batch: largest number of scenarios solved together
+    def __init__(self, compiled, window=0.005, max_batch=256):
+        self.compiled = compiled
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []    # (demand, pollution, flow, future)
+        self.timer = None
+        self.tasks = set()   # batches being solved, kept from collection
+        self.batches = 0     # batches solved so far
+
+    # turn a scenario into (demand, pollution, flow) rows
+    # pollution is None if the scenario leaves it alone
+    def rows(self, scenario):
+        c = self.compiled
+        demand = array('d', c.demand)
+        for name, offset in scenario.get('demand', {}).items():
+            if name not in c.node_id:
+                raise Exception('Unknown node [%s]' % name)
+            demand[c.node_id[name]] += offset
+
+        flow = array('d', c.flow)
+        for name, value in scenario.get('flows', {}).items():
+            if name not in c.edge_id or not c.root[c.edge_id[name]]:
+                raise Exception('Unknown root reach [%s]' % name)
+            flow[c.edge_id[name]] = value
+
+        pollution = None
+        if scenario.get('pollution'):
+            pollution = array('d', c.pollution)
+            for name, value in scenario['pollution'].items():
+                if name not in c.edge_id:
+                    raise Exception('Unknown reach [%s]' % name)
+                if not (isinstance(value, (int, float)) and
+                        math.isfinite(value) and 0 < value <= 1):
+                    raise Exception('Pollution index of [%s] must be in '
+                                    '(0, 1]' % name)
+                pollution[c.edge_id[name]] = value
+        return demand, pollution, flow
+
+    # solve a scenario along with whatever else arrives in the window
+    async def solve(self, scenario):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending += [self.rows(scenario) + (future,)]
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    # hand the pending scenarios to a worker thread as one batch
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.batches += 1
+            task = asyncio.ensure_future(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    # solve a batch in a worker thread; returns (flows, deficits)
+    async def solve_batch(self, batch):
+        demand, pollution, flow, _ = zip(*batch)
+        if all(rows is None for rows in pollution):
+            pollution = None
+        else:
+            pollution = [self.compiled.pollution if rows is None else rows
+                         for rows in pollution]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: self.compiled.solve_batch(
+                list(demand), pollution, list(flow), strict=False))
+
+    async def run(self, batch):
+        futures = [item[-1] for item in batch]
+        try:
+            flows, deficits = await self.solve_batch(batch)
+        except Exception:
+            # solve the scenarios one by one, so only the bad ones fail
+            flows, deficits = [], []
+            for item in batch:
+                try:
+                    result = await self.solve_batch([item])
+                except Exception as err:
+                    if not item[-1].done():
+                        item[-1].set_exception(err)
+                    result = [None], [None]
+                flows += result[0]
+                deficits += result[1]
+
+        c = self.compiled
+        for future, flow, deficit in zip(futures, flows, deficits):
+            if flow is not None and not future.done():
+                future.set_result({
+                    'flows': c.flows(flow),
+                    'deficits': dict((c.node_names[i], D)
+                                     for i, D in enumerate(deficit) if D)
+                })
+
+class SolveService(object):
+    # a SolveService answers HTTP solve requests, with one Batcher per
+    # season; connections are kept alive between requests
+
+    # constructor takes:
+    #   seasons: names of the season models to serve
+    #   window, max_batch: passed on to each Batcher
+    def __init__(self, seasons=('kharif', 'rabi'), window=0.005,
+                 max_batch=256):
+        self.batchers = {}
+        for season in seasons:
+            graph, _, _ = get_model(season)
+            self.batchers[season] = Batcher(graph.compile(), window,
+                                            max_batch)
+
+    # answer one parsed request; returns (status, JSON-able body)
+    async def handle(self, method, path, body):
+        if path != '/solve':
+            return 404, {'error': 'Not found'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            scenario = json.loads(body or b'{}')
+            season = scenario.get('season', 'kharif')
+            if season not in self.batchers:
+                raise Exception('Unknown season [%s]' % season)
+            return 200, await self.batchers[season].solve(scenario)
+        except Exception as err:
+            return 400, {'error': str(err)}
+
+    # serve HTTP/1.1 requests on one connection until it is closed
+    async def connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(
+                    int(headers.get('content-length', 0)))
+
+                status, result = await self.handle(method, path, body)
+                data = json.dumps(result).encode()
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write(('HTTP/1.1 %d %s\r\n'
+                              'Content-Type: application/json\r\n'
+                              'Content-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n'
+                              % (status, STATUS[status], len(data),
+                                 'close' if close else 'keep-alive'))
+                             .encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # start listening on a TCP port, or on a Unix socket if a path is given
+    # the backlog is long enough for hundreds of clients connecting at once
+    async def start(self, host='127.0.0.1', port=8080, unix=None,
+                    backlog=1024):
+        if unix is not None:
+            return await asyncio.start_unix_server(self.connection, unix,
+                                                   backlog=backlog)
+        return await asyncio.start_server(self.connection, host, port,
+                                          backlog=backlog)
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+          405: 'Method Not Allowed'}
+
+async def serve(args):
+    service = SolveService(args.seasons, args.window / 1000, args.max_batch)
+    server = await service.start(args.host, args.port, args.unix)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve batched what-if '
+                                     'solves of the season models.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', help='listen on this Unix socket instead')
+    parser.add_argument('--seasons', nargs='+', default=['kharif', 'rabi'])
+    parser.add_argument('--window', type=float, default=5,
+                        help='how long to collect a batch, in milliseconds')
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(serve(args))
@@ -0,0 +1,112 @@
+# memory-mapped on-disk store for the results of large sweeps
+# flows live in a preallocated file of doubles indexed by (scenario, reach)
+# and are read and written in place, so a sweep never has to fit in memory
+
+import json
+import mmap
+import os
+from array import array
+
+class ResultStore(object):
+    # a ResultStore is a (scenario, reach) table of flows on disk
+    #   path + '.dat' holds the flows as native-endian doubles, row-major
+    #   path + '.json' holds the reach names and per-scenario parameters
+    # unwritten rows read as zeros
+
+    # constructor opens an existing store; use ResultStore.create for a new one
+    # takes:
+    #   path of the store, without an extension (string)
+    #   writable: whether rows may be written (bool)
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        self.reach_names = meta['reach_names']
+        self.params = meta['params']
+        self.reach_id = dict((name, i) for i, name
+                             in enumerate(self.reach_names))
+        self.scenarios = len(self.params)
+        self.width = len(self.reach_names)
+
+        self.file = open(path + '.dat', 'r+b' if writable else 'rb')
+        # an empty file (no scenarios or no reaches) cannot be mapped, and
+        #   gets an empty view instead
+        self.map = None
+        if self.scenarios and self.width:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_WRITE if writable
+                                        else mmap.ACCESS_READ)
+            self.view = memoryview(self.map).cast('d')
+        else:
+            self.view = memoryview(array('d'))
+
+    # create a new store, preallocating space for every scenario
+    # takes:
+    #   path of the store, without an extension (string)
+    #   reach_names: the column names, e.g. CompiledGraph.edge_names
+    #   params: one JSON-able record of parameters per scenario
+    # returns the store, opened for writing
+    @classmethod
+    def create(cls, path, reach_names, params):
+        with open(path + '.json', 'w') as f:
+            json.dump({'reach_names': list(reach_names),
+                       'params': list(params)}, f)
+        size = len(params) * len(reach_names) * array('d').itemsize
+        with open(path + '.dat', 'wb') as f:
+            f.truncate(size)
+        return cls(path, writable=True)
+
+    # the flows of one scenario, as a view into the file; nothing is copied
+    # release the view before closing the store
+    def row(self, s):
+        return self.view[s * self.width:(s + 1) * self.width]
+
+    # write the flows of one scenario in place
+    # flow should be an array('d'), as returned by the solvers
+    def write(self, s, flow):
+        self.view[s * self.width:(s + 1) * self.width] = memoryview(flow)
+
+    # the flows of one reach over every scenario (or a range of them)
+    # this is a strided read, so only the touched pages are loaded
+    def column(self, name, start=0, stop=None):
+        stop = self.scenarios if stop is None else stop
+        e = self.reach_id[name]
+        return array('d', self.view[start * self.width + e:
+                                    stop * self.width:self.width])
+
+    # a single value
+    def get(self, s, name):
+        return self.view[s * self.width + self.reach_id[name]]
+
+    # make sure everything written so far is on disk
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# write one scenario's flows into the store at path
+# for worker processes, which cannot share an open store with the parent;
+#   different workers may write different rows at the same time
+# the row goes straight into the .dat file, without reading the metadata;
+#   flow has one entry per reach, and is written without copying if it is
+#   already an array('d'), as returned by the solvers
+def write_row(path, s, flow):
+    if not (isinstance(flow, array) and flow.typecode == 'd'):
+        flow = array('d', flow)
+    data = memoryview(flow).cast('B')
+    fd = os.open(path + '.dat', os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, s * len(data))
+    finally:
+        os.close(fd)
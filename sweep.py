@@ -0,0 +1,74 @@
+# parallel sensitivity sweeps over a process pool
+
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import ResultCache
+from model import get_model
+
+# build a fresh, unshared Kharif model
+def fresh_kharif():
+    return get_model('kharif', fresh=True)
+
+# run a single perturbation on a fresh model from the factory
+# this has to live at module level so the pool can pickle it
+# cache is the path of a ResultCache shared by the workers, or None
+def run_one(factory, perturb, level, outlet, cache=None):
+    graph, crops, rivers = factory()
+    if cache is None:
+        base = graph.solve()[outlet]
+        perturb(level, graph, crops, rivers)
+        flow = graph.solve()[outlet]
+    else:
+        with ResultCache(cache) as results:
+            base = results.solve(graph)[0][outlet]
+            perturb(level, graph, crops, rivers)
+            flow = results.solve(graph)[0][outlet]
+    return {
+        'perturbation': perturb.__name__,
+        'level': level,
+        'base': base,
+        'outflow': flow,
+        'change': (flow - base) / base
+    }
+
+# run every perturbation at every level, spread across a process pool
+# takes:
+#   factory: picklable function returning a fresh (graph, crops, rivers)
+#   perturbations: change functions like those in sensitivity.py,
+#     called as f(level, graph, crops, rivers)
+#   levels: the delta levels to try for each perturbation
+#   workers: number of processes, defaults to one per core
+#   outlet: name of the reach whose flow is reported
+#   cache: path of a ResultCache, so solves already done by this or an
+#     earlier sweep are read back instead of repeated
+# every run gets its own model, so runs cannot contaminate each other
+# returns a table of rows, one per (perturbation, level), in input order
+def run_sweep(factory, perturbations, levels, workers=None, outlet='OUT',
+              cache=None):
+    runs = [(f, level) for f in perturbations for level in levels]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, factory, f, level, outlet, cache)
+                   for f, level in runs]
+        return [future.result() for future in futures]
+
+# pretty-print a sweep table
+def format_table(rows):
+    lines = ['%-20s %8s %16s %10s' % ('perturbation', 'level',
+                                      'outflow', 'change')]
+    for row in rows:
+        lines += ['%-20s %8.3f %16.3f %+10.5f' % (row['perturbation'],
+                                                  row['level'],
+                                                  row['outflow'],
+                                                  row['change'])]
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    from sensitivity import change_inflows, change_areas, change_pollution, \
+                            change_population, change_rainfall
+
+    # tornado-plot sweep of the Kharif model
+    rows = run_sweep(fresh_kharif,
+                     [change_inflows, change_areas, change_pollution,
+                      change_population, change_rainfall],
+                     [0.95, 1.05])
+    print(format_table(rows))
@@ -0,0 +1,118 @@
+# time-stepped simulation over a single, shared basin topology
+# each step only changes parameter arrays; the topology is compiled once
+
+from array import array
+
+from compiled import CompiledGraph
+from network import Node
+
+class Aquifer(object):
+    # an Aquifer is groundwater storage carried over between time steps
+    # it replaces the constant aquifer offset of the seasonal models
+
+    # constructor takes:
+    #   volume: water in storage at the start, in MCM (float)
+    #   recharge: natural recharge rate, in MCM / year (float)
+    #   capacity: largest pumping rate, in MCM / year (float)
+    def __init__(self, volume, recharge, capacity):
+        self.volume = volume
+        self.recharge = recharge
+        self.capacity = capacity
+
+    # pump for one step of dt years; returns the pumping rate, in MCM / year
+    def pump(self, dt):
+        rate = min(self.capacity, max(self.volume, 0) / dt)
+        self.volume += (self.recharge - rate) * dt
+        return rate
+
+class Simulation(object):
+    # a Simulation runs a basin through a series of time steps
+    # node demands are split into parts so they can be rebuilt every step:
+    #   crop demand, urban demand, rainfall offset, groundwater offset, and
+    #   whatever else was applied to the graph (e.g. the population offset)
+
+    # constructor takes:
+    #   a built network.Graph, with its root reaches already set
+    #   rainfall: the rainfall already applied to its demands, in m / year
+    #   aquifer: the distributed constant offset already applied to its
+    #     demands, in MCM / year (e.g. -20480.61103 for model.py)
+    def __init__(self, graph, rainfall=0, aquifer=0):
+        self.compiled = CompiledGraph(graph)
+        self.rainfall = rainfall
+        self.aquifer = aquifer
+        nodes = [graph.get_node(name) for name in self.compiled.node_names]
+        self.area = array('d', [node.area for node in nodes])
+        self.urban = array('d', [node.population * Node.scarcity_threshold
+                                 / 1000000 for node in nodes])
+        self.crops = [node.crop for node in nodes]
+        self.needs = {}    # Node.crop_need, indexed by crop type
+
+        # the aquifer offset was handed out in proportion to the crop and
+        # urban demands, before any other offset was applied
+        base = [node.avg_crop_need * node.area * 2 + urban
+                for node, urban in zip(nodes, self.urban)]
+        total = sum(base)
+        self.share = array('d', [d / total for d in base])
+        self.other = array('d', [node.demand - d - share * aquifer
+                                 + area * rainfall
+                                 for node, d, share, area
+                                 in zip(nodes, base, self.share, self.area)])
+
+    # node demands for one step
+    # takes the step's rainfall (m / year), crops (list per node) and
+    #   groundwater offset (MCM / year, negative when pumping)
+    def demands(self, rainfall, crops, groundwater):
+        for crop in crops:
+            if crop not in self.needs:
+                self.needs[crop] = Node.crop_need(crop)
+        needs = self.needs
+        return array('d', [needs[crop] * area * 2 + urban + other
+                           - area * rainfall + share * groundwater
+                           for crop, area, urban, other, share
+                           in zip(crops, self.area, self.urban, self.other,
+                                  self.share)])
+
+    # run the simulation
+    # takes:
+    #   steps: number of time steps (int)
+    #   inflows: {root reach name: list of flows per step}, in MCM / year
+    #   rainfall: list of rainfall per step, in m / year
+    #   crops: {node name: list of crop types per step}, a crop calendar
+    #   aquifer: groundwater, either an Aquifer carried over between steps
+    #     or a constant offset in MCM / year applied every step
+    #   dt: length of a step, in years
+    # unspecified inputs keep the graph's values; rates stay in per-year
+    #   units like the rest of the model, only storage uses dt
+    # without an Aquifer the steps are independent, so they are all solved
+    #   in a single batch; otherwise they are solved in order
+    # returns (flows per step, aquifer volume at the end of each step)
+    def run(self, steps, inflows=None, rainfall=None, crops=None,
+            aquifer=None, dt=1 / 12):
+        c = self.compiled
+        aquifer = self.aquifer if aquifer is None else aquifer
+        inflows = [(c.edge_id[name], series)
+                   for name, series in (inflows or {}).items()]
+        crop_series = [(c.node_id[name], series)
+                       for name, series in (crops or {}).items()]
+
+        def step_inputs(t, groundwater):
+            flow = array('d', c.flow)
+            for e, series in inflows:
+                flow[e] = series[t]
+            step_crops = list(self.crops)
+            for i, series in crop_series:
+                step_crops[i] = series[t]
+            rain = self.rainfall if rainfall is None else rainfall[t]
+            return self.demands(rain, step_crops, groundwater), flow
+
+        if not isinstance(aquifer, Aquifer):
+            demand, flow = zip(*[step_inputs(t, aquifer)
+                                 for t in range(steps)])
+            return c.solve_batch(list(demand), None, list(flow)), None
+
+        flows, volumes = [], []
+        for t in range(steps):
+            demand, flow = step_inputs(t, -aquifer.pump(dt))
+            flows += [c.solve(demand, None, flow)]
+            volumes += [aquifer.volume]
+        return flows, volumes